@@ -1,4 +1,9 @@
+from array import array
+
+
 class Note:
+    __slots__ = ("index", "onset", "pitch", "dur", "vel")
+
     def __init__(self, index: int, onset: int, pitch: int, dur: int, vel: int):
         self.index = index
         self.onset = onset
@@ -12,3 +17,125 @@ class Note:
     def update_dur(self, new_dur: int):
         self.dur = new_dur
 
+    def __iter__(self):
+        return iter((self.index, self.onset, self.pitch, self.dur, self.vel))
+
+
+class NoteView:
+    """ a note of a NoteArray, read and written through to the array """
+    __slots__ = ("notes", "i")
+
+    def __init__(self, notes: "NoteArray", i: int):
+        self.notes = notes
+        self.i = i
+
+    @property
+    def index(self) -> int:
+        return self.notes.index[self.i]
+
+    @property
+    def onset(self) -> int:
+        return self.notes.onset[self.i]
+
+    @property
+    def pitch(self) -> int:
+        return self.notes.pitch[self.i]
+
+    @property
+    def dur(self) -> int:
+        return self.notes.dur[self.i]
+
+    @property
+    def vel(self) -> int:
+        return self.notes.vel[self.i]
+
+    def update_pitch(self, new_pitch: int):
+        self.notes.pitch[self.i] = new_pitch
+
+    def update_dur(self, new_dur: int):
+        self.notes.dur[self.i] = new_dur
+
+    def __iter__(self):
+        return iter(self.notes.row(self.i))
+
+
+class NoteArray:
+    """
+    notes stored as parallel int arrays (index, onset, pitch, dur, vel), about 20 bytes a note.
+
+    indexing gives a NoteView, slicing a new NoteArray; whole columns can be read and
+    updated through the index / onset / pitch / dur / vel arrays.
+    """
+    fields = ("index", "onset", "pitch", "dur", "vel")
+    __slots__ = fields
+
+    def __init__(self, notes=()):
+        for field in self.fields:
+            setattr(self, field, array("i"))
+        for note in notes:
+            self.append(*note)
+
+    @classmethod
+    def from_columns(cls, index, onset, pitch, dur, vel) -> "NoteArray":
+        notes = cls()
+        for field, column in zip(cls.fields, (index, onset, pitch, dur, vel)):
+            getattr(notes, field).extend(column)
+        if len({len(getattr(notes, field)) for field in cls.fields}) > 1:
+            raise ValueError("note columns differ in length")
+        return notes
+
+    @classmethod
+    def _wrap(cls, index: array, onset: array, pitch: array, dur: array, vel: array) -> "NoteArray":
+        # takes ownership of equally long int arrays, without copying
+        notes = cls.__new__(cls)
+        notes.index, notes.onset, notes.pitch, notes.dur, notes.vel = index, onset, pitch, dur, vel
+        return notes
+
+    def columns(self) -> tuple:
+        return self.index, self.onset, self.pitch, self.dur, self.vel
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return NoteArray._wrap(*(column[key] for column in self.columns()))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("note index out of range")
+        return NoteView(self, key)
+
+    def __delitem__(self, key: slice):
+        for column in self.columns():
+            del column[key]
+
+    def __iter__(self):
+        return (NoteView(self, i) for i in range(len(self)))
+
+    def row(self, i: int) -> tuple:
+        return self.index[i], self.onset[i], self.pitch[i], self.dur[i], self.vel[i]
+
+    def rows(self, start: int = 0, stop: int = None):
+        """ (index, onset, pitch, dur, vel) tuples of notes[start:stop], the fastest way to walk the notes """
+        if start == 0 and stop is None:
+            return zip(*self.columns())
+        return zip(*(column[start:stop] for column in self.columns()))
+
+    def append(self, index: int, onset: int, pitch: int, dur: int, vel: int):
+        self.index.append(index)
+        self.onset.append(onset)
+        self.pitch.append(pitch)
+        self.dur.append(dur)
+        self.vel.append(vel)
+
+    def extend(self, other: "NoteArray"):
+        for column, other_column in zip(self.columns(), other.columns()):
+            column.extend(other_column)
+
+    def copy(self) -> "NoteArray":
+        return self[:]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in self.columns())
@@ -0,0 +1,158 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cli
+from collection import Collection
+
+# op => its parameters, in the order of the matching script's positional arguments
+op_params = {
+    "repeat": ["start", "end", "timesig"],
+    "sequence": ["start", "end", "endpitch", "timesig"],
+    "tidy": ["start", "timesig"],
+}
+csv_int_fields = ["start", "end", "endpitch", "timesig", "seed"]
+
+
+def output_basename(chain: dict) -> str:
+    """
+    the basename of the tidy_* / group_* files of a chain. by default a chain with a repeat or sequence
+    writes rand_<file name>, unique per coll; a tidy_<name> coll (tidy_rand_coll of the Max flow) stays
+    its own tidy file under <name>, as with the scripts. a tidy alone writes under the coll's own name
+    """
+    if chain["basename"]:
+        return chain["basename"]
+    name = os.path.basename(chain["file"])
+    if all(op["op"] == "tidy" for op in chain["ops"]):
+        return name
+    return name[len("tidy_"):] if name.startswith("tidy_") else f"rand_{name}"
+
+
+def read_manifest(manifest_fp: str) -> list:
+    """
+    the chains of a manifest, as [{"file", "basename", "ops": [{"op", params...}]}], one per coll file
+    in order of first appearance. relative paths are relative to the manifest.
+
+    json: [{"file": ..., "basename": optional, "ops": [{"op": "sequence", "start": 0, "end": 4,
+    "endpitch": 62, "timesig": 4, "seed": optional}, ...]}, ...]
+    csv: a header with file, op and the parameter columns (start, end, endpitch, timesig, seed,
+    basename), one operation per row; the rows of a file are its chain
+    """
+    with open(manifest_fp, newline="") as rf:
+        if manifest_fp.endswith(".csv"):
+            entries = []
+            for row in csv.DictReader(rf):
+                op = {"op": row["op"]}
+                for field in csv_int_fields:
+                    if row.get(field):
+                        op[field] = int(row[field])
+                entries.append({"file": row["file"], "basename": row.get("basename") or None, "ops": [op]})
+        else:
+            entries = json.load(rf)
+
+    chains = {}
+    for k, entry in enumerate(entries):
+        for op in entry["ops"]:
+            if op.get("op") not in op_params:
+                raise ValueError(f"manifest entry {k}: unknown operation {op.get('op')}, expected one of {list(op_params)}")
+            missing = [param for param in op_params[op["op"]] if op.get(param) is None]
+            if missing:
+                raise ValueError(f"manifest entry {k}: {op['op']} needs {', '.join(missing)}")
+        coll_fp = os.path.join(os.path.dirname(os.path.abspath(manifest_fp)), entry["file"])
+        chain = chains.setdefault(coll_fp, {"file": coll_fp, "basename": entry.get("basename"), "ops": []})
+        chain["ops"] += entry["ops"]
+
+    # chains writing the same tidy_* / group_* files would overwrite each other (and race in a pool)
+    outputs = {}
+    for chain in chains.values():
+        output = (os.path.dirname(chain["file"]), output_basename(chain))
+        if output in outputs:
+            raise ValueError(f"{outputs[output]} and {chain['file']} both write tidy_{output[1]} and "
+                f"group_{output[1]}: give them distinct basenames")
+        outputs[output] = chain["file"]
+    return list(chains.values())
+
+
+def apply_op(coll: Collection, op: dict, cache=None):
+    if op["op"] == "repeat":
+        start_idx, end_idx, time_sig = op["start"], op["end"], op["timesig"]
+        coll.cached(cache, ("repeat", start_idx, end_idx, time_sig),
+            lambda c: c.repeat(start_idx, end_idx).tidy(end_idx - 1, time_sig))
+    elif op["op"] == "sequence":
+        start_idx, end_idx, endpitch, time_sig = op["start"], op["end"], op["endpitch"], op["timesig"]
+        seed = op.get("seed")
+        rng = random.Random(seed) if seed is not None else random
+        coll.cached(cache if seed is not None else None, ("sequence", start_idx, end_idx, endpitch, time_sig),
+            lambda c: c.sequence(start_idx, end_idx, endpitch, rng).tidy(end_idx - 1, time_sig), rng)
+    else:
+        coll.tidy(op["start"], op["timesig"])
+
+def run_chain(chain: dict, cache_dir: str = None) -> dict:
+    """ load the coll once, apply its operations in order and write the coll, tidy_* and group_* files """
+    from phrase_cache import PhraseCache
+    cache = PhraseCache(disk_dir=cache_dir) if cache_dir else None
+    result = {"file": chain["file"], "ops": len(chain["ops"]), "error": None}
+    start = time.perf_counter()
+    try:
+        # a repeat or sequence changes the coll, a tidy alone only writes the tidy_* / group_* files
+        changes_coll = any(op["op"] != "tidy" for op in chain["ops"])
+        coll = Collection.load(chain["file"], output_basename(chain))
+        for op in chain["ops"]:
+            apply_op(coll, op, cache)
+        # the groups go to the report rather than to the console
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            coll.save(write_coll=changes_coll)
+        result.update(notes=len(coll.notes), tidy_file=coll.tidy_filepath, group_file=coll.group_filepath,
+            groups=coll.groups)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_manifest(manifest_fp: str, workers: int = 1, cache_dir: str = None) -> dict:
+    chains = read_manifest(manifest_fp)
+    start = time.perf_counter()
+    if workers > 1 and len(chains) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_chain, chains, [cache_dir] * len(chains), chunksize=max(1, len(chains) // (workers * 4))))
+    else:
+        results = [run_chain(chain, cache_dir) for chain in chains]
+    return {
+        "manifest": os.path.abspath(manifest_fp),
+        "files": len(results),
+        "ops": sum(r["ops"] for r in results),
+        "failed": sum(1 for r in results if r["error"]),
+        "seconds": time.perf_counter() - start,
+        "results": results,
+    }
+
+
+def main(args):
+    try:
+        report = run_manifest(args.manifest, args.workers, args.cache)
+    except ValueError as e:
+        # a malformed manifest: nothing has run yet
+        raise SystemExit(f"{args.manifest}: {e}")
+    for r in report["results"]:
+        if r["error"]:
+            print(f"failed {r['file']}: {r['error']}")
+    print(f"{report['files']} files, {report['ops']} operations in {report['seconds']:.2f} s, {report['failed']} failed")
+    if args.report:
+        with open(args.report, "w") as wf:
+            json.dump(report, wf, indent=1)
+        print(f"written {args.report}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run repeat/sequence/tidy chains of a manifest over many colls")
+    cli.add_batch_arguments(parser)
+
+    args = parser.parse_args()
+    main(args)
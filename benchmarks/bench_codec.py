@@ -0,0 +1,118 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+import coll_codec
+from Note import NoteArray
+
+
+# the line by line loops the codec replaced, kept here as the baseline
+def loop_read_notes(coll_fp: str) -> NoteArray:
+    notes = NoteArray()
+    with open(coll_fp, "r") as f:
+        for line in f:
+            i, onset, pitch, dur, vel = line.strip().split()
+            notes.append(int(i[:-1]), int(onset), int(pitch), int(dur), int(vel[:-1]))
+    return notes
+
+def loop_read_onsets_pitches(coll_fp: str):
+    pitches = []
+    onsets = []
+    with open(coll_fp) as rf:
+        for line in rf:
+            props = line.split()
+            onsets.append(int(props[1]))
+            pitches.append(int(props[2]))
+    return onsets, pitches
+
+def loop_write(coll_fp: str, notes: NoteArray):
+    with open(coll_fp, "w") as wf:
+        for i, onset, pitch, dur, vel in notes.rows():
+            wf.write(f"{i}, {onset} {pitch} {dur} {vel};\n")
+
+def loop_write_groups(group_fp: str, groups: list):
+    with open(group_fp, "w") as f:
+        for i, num in enumerate(groups):
+            f.write(f"{i}, {num};\n")
+
+
+def make_coll(coll_fp: str, num_notes: int, seed: int = 0):
+    rng = random.Random(seed)
+    notes = NoteArray()
+    for i in range(num_notes):
+        notes.append(i, rng.randrange(48), rng.randrange(36, 96), rng.choice([3, 6, 12, 24, -12]), rng.randrange(40, 128))
+    coll_codec.write(coll_fp, *notes.columns())
+    return notes
+
+def best_of(rounds: int, fn) -> float:
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        coll_fp = os.path.join(work_dir, "big.txt")
+        out_fp = os.path.join(work_dir, "out.txt")
+        notes = make_coll(coll_fp, args.notes)
+        groups = [random.Random(1).randrange(2, 6) for _ in range(args.notes // 4)]
+        size_mb = os.path.getsize(coll_fp) / 2 ** 20
+        print(f"{args.notes} notes, {size_mb:.1f} MB, best of {args.rounds}")
+
+        # (task, implementation, run, file whose size is the throughput)
+        cases = [
+            ("read notes", "loop", lambda: loop_read_notes(coll_fp), coll_fp),
+            ("read notes", "codec.read", lambda: coll_codec.read(coll_fp), coll_fp),
+            ("read onsets, pitches", "loop", lambda: loop_read_onsets_pitches(coll_fp), coll_fp),
+            ("read onsets, pitches", "codec.read_array", lambda: coll_codec.read_array(coll_fp), coll_fp),
+            ("read onsets, pitches", "codec.iter_arrays", lambda: list(coll_codec.iter_arrays(coll_fp)), coll_fp),
+            ("write notes", "loop", lambda: loop_write(out_fp, notes), out_fp),
+            ("write notes", "codec.write", lambda: coll_codec.write(out_fp, *notes.columns()), out_fp),
+            ("write groups", "loop", lambda: loop_write_groups(out_fp, groups), out_fp),
+            ("write groups", "codec.write_groups", lambda: coll_codec.write_groups(out_fp, groups), out_fp),
+        ]
+        baseline = {}
+        for task, name, fn, fp in cases:
+            seconds = best_of(args.rounds, fn)
+            baseline.setdefault(task, seconds)
+            mb = os.path.getsize(fp) / 2 ** 20
+            print(f"{task:<22} {name:<20} {seconds * 1000:8.1f} ms {mb / seconds:8.1f} MB/s "
+                f"{baseline[task] / seconds:6.2f}x")
+
+        # the small colls of the Max flow and the training corpus
+        small_fp = os.path.join(work_dir, "small.txt")
+        make_coll(small_fp, 100)
+        loop = statistics.median(best_of(args.rounds, lambda: loop_read_notes(small_fp)) for _ in range(5))
+        codec = statistics.median(best_of(args.rounds, lambda: coll_codec.read(small_fp)) for _ in range(5))
+        print(f"100-note coll: loop {loop * 1e6:.1f} us, codec.read {codec * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coll parsing and writing throughput: line loops vs the bulk codec")
+    parser.add_argument(
+        "--notes",
+        type=int,
+        default=200000,
+        help="number of notes of the large coll (200000 is about 4 MB)"
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=5,
+        help="number of runs of each case, the best is reported"
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,244 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import contextlib
+import datetime
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from synthetic import make_corpus
+
+stages = ["parse", "train_main", "add_transitions", "write_transitions", "tidy_up", "repetition", "sequence"]
+# stages trained per mode; the others run over both modes at once
+mode_stages = ["train_main", "add_transitions", "write_transitions"]
+
+
+def coll_files(corpus: str, time_sig: int, mode: str = None) -> list:
+    modes = mode or "+-"
+    return sorted(fp for fp in glob.glob(os.path.join(corpus, "midi_coll", "any", "*.txt"))
+        if fp[-5] == str(time_sig) and fp[-6] in modes)
+
+def count_lines(fps: list) -> int:
+    total = 0
+    for fp in fps:
+        with open(fp) as rf:
+            total += sum(1 for _ in rf)
+    return total
+
+def run_stage(stage: str, corpus: str, time_sig: int, mode: str, backend: str):
+    """ (number of files, number of notes, seconds spent in the timed calls) """
+    import cli
+    mode_name = {"+": "major", "-": "minor"}.get(mode)
+    work_dir = tempfile.mkdtemp(dir=corpus)
+
+    if stage == "parse":
+        import write_midi_coll
+        parse = write_midi_coll.get_parser(backend)
+        fps = sorted(fp for fp in glob.glob(os.path.join(corpus, "midi", "any", "*.mid")) if fp[-5] == str(time_sig))
+        os.makedirs(os.path.join(work_dir, "any"))
+        start = time.perf_counter()
+        colls = [parse(fp, coll_dir=work_dir) for fp in fps]
+        elapsed = time.perf_counter() - start
+        return len(fps), count_lines([fp for fp in colls if fp]), elapsed
+
+    if stage in mode_stages:
+        import train
+        fps = coll_files(corpus, time_sig, mode)
+        notes = count_lines(fps)
+        if stage == "train_main":
+            parser = argparse.ArgumentParser()
+            cli.add_train_arguments(parser)
+            args = parser.parse_args(["--mood", "any", "--mode", mode_name, "--timesig", str(time_sig),
+                "--colldir", os.path.join(corpus, "midi_coll"), "--outdir", work_dir])
+            start = time.perf_counter()
+            train.main(args)
+            return len(fps), notes, time.perf_counter() - start
+        tunes = train.read_coll_tunes(os.path.join(corpus, "midi_coll"), "any", train.get_modes(mode_name), time_sig)
+        pitch_markov = train.Markov(train.num_pitches)
+        onset_markov = train.Markov(train.num_onsets)
+        start = time.perf_counter()
+        for _, onsets, pitches in tunes:
+            pitch_markov.add_transitions(pitches)
+            onset_markov.add_transitions(onsets)
+        elapsed = time.perf_counter() - start
+        if stage == "add_transitions":
+            return len(fps), notes, elapsed
+        start = time.perf_counter()
+        pitch_markov.write_transitions(os.path.join(work_dir, "pitch_markov.txt"))
+        onset_markov.write_transitions(os.path.join(work_dir, "onset_markov.txt"))
+        return len(fps), notes, time.perf_counter() - start
+
+    # the coll transformations, on a copy of every coll of the timesig
+    fps = coll_files(corpus, time_sig)
+    notes = count_lines(fps)
+    elapsed = 0
+    if stage == "tidy_up":
+        import tidyup_coll
+        for fp in fps:
+            coll_fp = os.path.join(work_dir, os.path.basename(fp))
+            shutil.copy(fp, coll_fp)
+            start = time.perf_counter()
+            tidyup_coll.tidy_up(coll_fp, 0, time_sig)
+            elapsed += time.perf_counter() - start
+        return len(fps), notes, elapsed
+
+    import repetition
+    import sequence
+    import tidyup_coll
+    parser = argparse.ArgumentParser()
+    add_arguments = cli.add_repeat_arguments if stage == "repetition" else cli.add_sequence_arguments
+    add_arguments(parser)
+    coll_fp = os.path.join(work_dir, "tidy_rand_coll")
+    for fp in fps:
+        # the Max flow: a tidy coll, then a statement of its first notes repeated / sequenced
+        shutil.copy(fp, os.path.join(work_dir, "raw.txt"))
+        tidyup_coll.tidy_up(os.path.join(work_dir, "raw.txt"), 0, time_sig)
+        shutil.copy(os.path.join(work_dir, "tidy_raw.txt"), coll_fp)
+        if stage == "repetition":
+            args = parser.parse_args([coll_fp, "1", "5", str(time_sig)])
+            main = repetition.main
+        else:
+            args = parser.parse_args([coll_fp, "1", "5", "70", str(time_sig), "--seed", "0"])
+            main = sequence.main
+        start = time.perf_counter()
+        main(args)
+        elapsed += time.perf_counter() - start
+    return len(fps), notes, elapsed
+
+def child(args):
+    # a fresh process per measurement, so that the peak memory is that stage's own
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        num_files, num_notes, elapsed = run_stage(args.stage, args.corpus, args.timesig, args.mode, args.backend)
+    print(json.dumps({
+        "files": num_files,
+        "notes": num_notes,
+        "wall_s": elapsed,
+        # writing the tables costs the same for any corpus size
+        "notes_per_s": num_notes / elapsed if elapsed > 0 and args.stage != "write_transitions" else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def measure(stage: str, corpus: str, time_sig: int, mode: str, backend: str) -> dict:
+    argv = [sys.executable, os.path.abspath(__file__), "--stage", stage, "--corpus", corpus,
+        "--timesig", str(time_sig), "--backend", backend]
+    if mode:
+        argv += ["--mode", mode]
+    out = subprocess.run(argv, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=parent_dir, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: list, baseline_fp: str):
+    with open(baseline_fp) as rf:
+        baseline = {(r["scale"], r["stage"], r["timesig"], r["mode"]): r for r in json.load(rf)["results"]}
+    print(f"\ncompared to {baseline_fp} (wall time ratio, < 1 is faster)")
+    for r in results:
+        old = baseline.get((r["scale"], r["stage"], r["timesig"], r["mode"]))
+        if old and old["wall_s"] > 0:
+            print(f"{r['scale']:>5}x {r['stage']:<18} ts {r['timesig']} {r['mode'] or '':<2} "
+                f"{r['wall_s'] / old['wall_s']:6.2f}")
+
+
+def main(args):
+    scales = [int(s) for s in args.scales.split(",")]
+    selected = args.stages.split(",") if args.stages else stages
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as corpus:
+            start = time.perf_counter()
+            counts = make_corpus(corpus, scale, args.seed, midi="parse" in selected)
+            print(f"{scale}x: {counts['tunes']} tunes, {counts['notes']} notes "
+                f"(generated in {time.perf_counter() - start:.1f} s)")
+            for stage in selected:
+                for time_sig in [3, 4]:
+                    for mode in (["+", "-"] if stage in mode_stages else [None]):
+                        result = {"scale": scale, "stage": stage, "timesig": time_sig, "mode": mode}
+                        result.update(measure(stage, corpus, time_sig, mode, args.backend))
+                        results.append(result)
+                        rate = f"{result['notes_per_s']:12.0f}" if result["notes_per_s"] else f"{'-':>12}"
+                        print(f"{scale:>5}x {stage:<18} ts {time_sig} {mode or '':<2} {result['wall_s']:9.3f} s "
+                            f"{rate} notes/s {result['peak_rss_mb']:8.1f} MB")
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "seed": args.seed,
+        "results": results,
+    }
+    output = args.output or os.path.join(parent_dir, "benchmarks", "results",
+        f"scaling-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as wf:
+        json.dump(report, wf, indent=1)
+    print(f"written {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic corpora of growing size")
+    parser.add_argument(
+        "--scales",
+        type=str,
+        default="1,10,100,1000",
+        help="comma separated corpus sizes, as multiples of the bundled corpus (50 tunes)"
+    )
+    parser.add_argument(
+        "--stages",
+        type=str,
+        help=f"comma separated stages to run (default: all of {','.join(stages)})"
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="music21",
+        choices=["music21", "fast"],
+        help="midi parser timed by the parse stage: music21 (the ingest default) or fast"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed of the synthetic corpus"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="JSON report path (default: benchmarks/results/scaling-<timestamp>.json)"
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        help="an earlier JSON report to print wall time ratios against"
+    )
+    # internal: run a single measurement in this process
+    parser.add_argument("--stage", type=str, choices=stages, help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--timesig", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", type=str, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.stage:
+        child(args)
+    else:
+        main(args)
@@ -0,0 +1,110 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from collection import read_notes
+from transposition import candidate_endpitches, transpose_all, transpose_statement
+
+
+def prepare_coll(work_dir: str, tune_fp: str, time_sig: int):
+    shutil.copy(tune_fp, os.path.join(work_dir, "raw.txt"))
+    subprocess.run([sys.executable, os.path.join(parent_dir, "tidyup_coll.py"), "raw.txt", "0", str(time_sig)],
+        cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+
+def run_sequence(work_dir: str, argv: list):
+    subprocess.run([sys.executable, os.path.join(parent_dir, "sequence.py")] + argv,
+        cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+
+def time_processes(work_dir: str, endpitches: list, time_sig: int) -> float:
+    """ one sequence.py launch per end pitch, each on a fresh copy of the coll """
+    start = time.perf_counter()
+    for endpitch in endpitches:
+        shutil.copy(os.path.join(work_dir, "tidy_raw.txt"), os.path.join(work_dir, "tidy_rand_coll"))
+        run_sequence(work_dir, ["tidy_rand_coll", "0", "4", str(endpitch), str(time_sig)])
+    return time.perf_counter() - start
+
+def time_targets(work_dir: str, endpitch: int, time_sig: int) -> float:
+    shutil.copy(os.path.join(work_dir, "tidy_raw.txt"), os.path.join(work_dir, "tidy_rand_coll"))
+    start = time.perf_counter()
+    run_sequence(work_dir, ["tidy_rand_coll", "0", "4", str(endpitch), str(time_sig), "--targets", "pitches",
+        "--outdir", "audition", "--seed", "0"])
+    return time.perf_counter() - start
+
+def check_engines(coll_dir: str, endpitches: list, seeds: list = (0, 1, 2)):
+    """ transpose_all must give, row by row, what sequence.py <endpitch> --seed writes """
+    for mood in sorted(os.listdir(coll_dir)):
+        for f in sorted(os.listdir(os.path.join(coll_dir, mood))):
+            notes = read_notes(os.path.join(coll_dir, mood, f))
+            for start in range(0, len(notes) - 4, 4):
+                statement = notes[start:start + 4]
+                for seed in seeds:
+                    batch = transpose_all(statement.pitch, statement.dur, endpitches, notes.pitch[-1], seed)
+                    for endpitch, row in zip(endpitches, batch.tolist()):
+                        single = transpose_statement(statement.pitch, statement.dur, endpitch, notes.pitch[-1],
+                            random.Random(seed))
+                        assert row == single, (f, start, seed, endpitch, row, single)
+
+def time_engines(notes, endpitches: list, rounds: int):
+    statement = notes[0:8]
+    loop_times, batch_times = [], []
+    rng = random.Random(0)
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for endpitch in endpitches:
+            transpose_statement(statement.pitch, statement.dur, endpitch, notes.pitch[-1], rng)
+        loop_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        transpose_all(statement.pitch, statement.dur, endpitches, notes.pitch[-1], 0)
+        batch_times.append(time.perf_counter() - start)
+    return statistics.median(loop_times), statistics.median(batch_times)
+
+
+def main(args):
+    tune_fp = os.path.join(parent_dir, "midi_coll", "any", "totoro_m+4.txt")
+    time_sig = 4
+    endpitch = 62
+    endpitches = candidate_endpitches(endpitch, "pitches")
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_coll(work_dir, tune_fp, time_sig)
+        print(f"{len(endpitches)} sequence targets")
+        print(f"{'one process per target':<34} {time_processes(work_dir, endpitches, time_sig) * 1000:8.1f} ms")
+        print(f"{'one process, --targets pitches':<34} {time_targets(work_dir, endpitch, time_sig) * 1000:8.1f} ms")
+
+    check_engines(os.path.join(parent_dir, "midi_coll"), endpitches)
+    print("transpose_all matches transpose_statement for every end pitch and seed")
+
+    notes = read_notes(tune_fp)
+    wide = list(range(24, 96)) * args.repeat
+    loop, batch = time_engines(notes, wide, args.rounds)
+    print(f"{len(wide)} targets, 8-note statement: transpose_statement loop {loop * 1000:.2f} ms, "
+        f"transpose_all {batch * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sequencing every target in one call vs one process per target")
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=20,
+        help="number of runs to time the transposition engines"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=100,
+        help="times the 72 end pitches are repeated for the engine comparison"
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,102 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from server import decode_message, encode_message
+
+
+def prepare_coll(work_dir: str, tune_fp: str, time_sig: int) -> str:
+    """ a tidy_rand_coll to transform, as the Max patch would have it """
+    shutil.copy(tune_fp, os.path.join(work_dir, "raw.txt"))
+    subprocess.run([sys.executable, os.path.join(parent_dir, "tidyup_coll.py"), "raw.txt", "0", str(time_sig)],
+        cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+    coll_fp = os.path.join(work_dir, "tidy_rand_coll")
+    shutil.copy(os.path.join(work_dir, "tidy_raw.txt"), coll_fp)
+    return coll_fp
+
+def time_subprocess(work_dir: str, rounds: int, time_sig: int) -> list:
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(parent_dir, "repetition.py"), "tidy_rand_coll", "0", "4",
+            str(time_sig)], cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+def time_server(port: int, coll_fp: str, rounds: int, time_sig: int, flush: bool) -> list:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(5)
+
+    def request(address, *args):
+        sock.sendto(encode_message(address, *args), ("127.0.0.1", port))
+        reply, _ = sock.recvfrom(65536)
+        address, reply_args = decode_message(reply)
+        if address != "/done":
+            raise RuntimeError(reply_args)
+
+    request("/load", coll_fp, "rand_coll")
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        request("/repeat", coll_fp, 0, 4, time_sig)
+        if flush:
+            request("/flush", coll_fp)
+        times.append(time.perf_counter() - start)
+    request("/close", coll_fp)
+    sock.close()
+    return times
+
+def report(name: str, times: list):
+    print(f"{name:<28} median {statistics.median(times) * 1000:8.2f} ms   "
+        f"min {min(times) * 1000:8.2f} ms   max {max(times) * 1000:8.2f} ms")
+
+
+def main(args):
+    tune_fp = os.path.join(parent_dir, "midi_coll", "any", "totoro_m+4.txt")
+    time_sig = 4
+    server = subprocess.Popen([sys.executable, os.path.join(parent_dir, "server.py"), "--port", str(args.port)],
+        stdout=subprocess.DEVNULL)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            coll_fp = prepare_coll(work_dir, tune_fp, time_sig)
+            report("subprocess repetition.py", time_subprocess(work_dir, args.rounds, time_sig))
+
+            # give the server time to bind
+            time.sleep(0.5)
+            coll_fp = prepare_coll(work_dir, tune_fp, time_sig)
+            report("server /repeat", time_server(args.port, coll_fp, args.rounds, time_sig, flush=False))
+            coll_fp = prepare_coll(work_dir, tune_fp, time_sig)
+            report("server /repeat + /flush", time_server(args.port, coll_fp, args.rounds, time_sig, flush=True))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Round-trip latency of the transformation server vs one process per call")
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=30,
+        help="number of repetitions to time for each mode"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=7499,
+        help="UDP port for the benchmark server"
+    )
+
+    args = parser.parse_args()
+    main(args)
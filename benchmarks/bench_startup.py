@@ -0,0 +1,89 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imports a light subcommand should never pay for
+heavy_modules = ["numpy", "music21"]
+
+
+def prepare_work_dir(work_dir: str, tune_fp: str, midi_fp: str, time_sig: int):
+    """ a raw coll, its tidy_rand_coll and a midi file to ingest """
+    shutil.copy(tune_fp, os.path.join(work_dir, "raw.txt"))
+    run_cli(work_dir, ["tidy", "raw.txt", "0", str(time_sig)])
+    shutil.copy(os.path.join(work_dir, "tidy_raw.txt"), os.path.join(work_dir, "tidy_rand_coll"))
+    os.makedirs(os.path.join(work_dir, "midi", "any"))
+    os.makedirs(os.path.join(work_dir, "midi_coll", "any"))
+    shutil.copy(midi_fp, os.path.join(work_dir, "midi", "any"))
+
+def run_cli(work_dir: str, argv: list, python_flags: list = None) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable] + (python_flags or []) + [os.path.join(parent_dir, "cli.py")] + argv,
+        cwd=work_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+def time_cli(work_dir: str, argv: list, rounds: int) -> list:
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run_cli(work_dir, argv)
+        times.append(time.perf_counter() - start)
+    return times
+
+def imported_heavy_modules(work_dir: str, argv: list) -> list:
+    # -X importtime lists every imported module on stderr as "import time: self | cumulative | name"
+    stderr = run_cli(work_dir, argv, ["-X", "importtime"]).stderr
+    names = {line.split("|")[-1].strip() for line in stderr.splitlines() if line.startswith("import time:")}
+    return [name for name in heavy_modules if name in names]
+
+def report(name: str, times: list, heavy: list):
+    print(f"{name:<34} median {statistics.median(times) * 1000:8.2f} ms   "
+        f"min {min(times) * 1000:8.2f} ms   heavy imports: {', '.join(heavy) or '-'}")
+
+
+def main(args):
+    tune_fp = os.path.join(parent_dir, "midi_coll", "any", "totoro_m+4.txt")
+    midi_fp = os.path.join(parent_dir, "midi", "any", "totoro_m+4.mid")
+    time_sig = 4
+    cases = [
+        ("python (interpreter only)", None),
+        ("cli --help", ["--help"]),
+        ("ingest --help", ["ingest", "--help"]),
+        ("ingest --backend fast", ["ingest", "--midifile", os.path.join("midi", "any", os.path.basename(midi_fp)),
+            "--backend", "fast"]),
+        ("train --help", ["train", "--help"]),
+        ("repeat", ["repeat", "tidy_rand_coll", "0", "4", str(time_sig)]),
+        ("sequence", ["sequence", "tidy_rand_coll", "0", "4", "60", str(time_sig)]),
+        ("tidy", ["tidy", "raw.txt", "0", str(time_sig)]),
+    ]
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_work_dir(work_dir, tune_fp, midi_fp, time_sig)
+        for name, argv in cases:
+            if argv is None:
+                times = []
+                for _ in range(args.rounds):
+                    start = time.perf_counter()
+                    subprocess.run([sys.executable, "-c", "pass"], check=True)
+                    times.append(time.perf_counter() - start)
+                report(name, times, [])
+                continue
+            report(name, time_cli(work_dir, argv, args.rounds), imported_heavy_modules(work_dir, argv))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start time of each cli.py subcommand")
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=20,
+        help="number of runs to time for each subcommand"
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,105 @@
+import os
+import random
+import struct
+import sys
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from constants import tick_quarter
+
+# the bundled corpus: 50 tunes of about 100 notes, each in midi/any and in one mood folder
+base_tunes = 50
+base_notes = 100
+moods = ["happy", "nostalgic", "whimsical"]
+
+midi_ticks_per_quarter = 480
+# C minor / Eb major, the key every coll is normalized to
+scale_pitches = [p for p in range(55, 85) if p % 12 in (0, 2, 3, 5, 7, 8, 10)]
+# the keys written to the midi files (3 flats major, 6 flats minor) both have tonic E-,
+# so key normalization leaves the pitches untouched
+key_signatures = {"+": (-3, 0), "-": (-6, 1)}
+
+
+def synth_tune(rng: random.Random, time_sig: int, num_notes: int) -> list:
+    """ (onset tick in the measure, measure, pitch, vel) of a random walk over the scale """
+    measure_tick = tick_quarter * time_sig
+    grid = list(range(0, measure_tick, tick_quarter // 2))
+    notes = []
+    pitch_i = rng.randrange(len(scale_pitches))
+    measure = 0
+    while len(notes) < num_notes:
+        # every measure has a note, so no note is tied over more than one barline
+        onsets = sorted(rng.sample(grid, rng.randint(1, min(6, len(grid)))))
+        if rng.random() < 0.8 and onsets[0] != 0:
+            onsets[0] = 0
+        for onset in onsets:
+            pitch_i = min(max(pitch_i + rng.choice([-2, -1, -1, 0, 1, 1, 2]), 0), len(scale_pitches) - 1)
+            notes.append((onset, measure, scale_pitches[pitch_i], rng.randint(60, 100)))
+        measure += 1
+    return notes[:num_notes]
+
+
+def var_len(value: int) -> bytes:
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+def write_midi(midi_fp: str, notes: list, time_sig: int, mode: str):
+    """ a format 0 midi file; each note lasts until the next onset (the last one to its barline) """
+    scale = midi_ticks_per_quarter // tick_quarter
+    measure_tick = tick_quarter * time_sig
+    starts = [(measure * measure_tick + onset) * scale for onset, measure, _, _ in notes]
+    ends = starts[1:] + [(notes[-1][1] + 1) * measure_tick * scale]
+    sharps, minor = key_signatures[mode]
+    events = [
+        (0, 0, b"\xff\x58\x04" + bytes([time_sig, 2, 24, 8])),
+        (0, 0, b"\xff\x59\x02" + struct.pack("bB", sharps, minor)),
+        (0, 0, b"\xff\x51\x03" + (500000).to_bytes(3, "big")),
+    ]
+    for start, end, (_, _, pitch, vel) in zip(starts, ends, notes):
+        # note-offs sort before note-ons on the same tick
+        events.append((start, 1, bytes([0x90, pitch, vel])))
+        events.append((end, 0, bytes([0x80, pitch, 0])))
+    events.sort(key=lambda e: (e[0], e[1]))
+    track = b""
+    last_tick = 0
+    for tick, _, data in events:
+        track += var_len(tick - last_tick) + data
+        last_tick = tick
+    track += b"\x00\xff\x2f\x00"
+    with open(midi_fp, "wb") as wf:
+        wf.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, midi_ticks_per_quarter))
+        wf.write(b"MTrk" + struct.pack(">I", len(track)) + track)
+
+def write_coll(coll_fp: str, notes: list):
+    """ the coll parse_file writes for the midi of the same notes """
+    with open(coll_fp, "w") as wf:
+        wf.write("".join(f"{i}, {onset} {pitch} 100 {vel};\n" for i, (onset, _, pitch, vel) in enumerate(notes)))
+
+
+def make_corpus(root: str, scale: int, seed: int = 0, time_sigs: list = (3, 4), midi: bool = True) -> dict:
+    """
+    write scale times the bundled corpus size to <root>/midi and <root>/midi_coll,
+    cycling through the time signatures and both modes; returns the counts
+    """
+    rng = random.Random(seed)
+    for top in ["midi", "midi_coll"]:
+        for mood in ["any"] + moods:
+            os.makedirs(os.path.join(root, top, mood), exist_ok=True)
+    num_tunes = base_tunes * scale
+    num_notes = 0
+    for i in range(num_tunes):
+        time_sig = time_sigs[i % len(time_sigs)]
+        mode = "+-"[(i // len(time_sigs)) % 2]
+        notes = synth_tune(rng, time_sig, rng.randint(base_notes // 2, base_notes * 3 // 2))
+        num_notes += len(notes)
+        name = f"synth{i:06d}_s{mode}{time_sig}"
+        for mood in ["any", moods[i % len(moods)]]:
+            write_coll(os.path.join(root, "midi_coll", mood, name + ".txt"), notes)
+            if midi:
+                write_midi(os.path.join(root, "midi", mood, name + ".mid"), notes, time_sig, mode)
+    return {"tunes": num_tunes, "notes": num_notes}
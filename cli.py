@@ -0,0 +1,382 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import importlib
+import os
+
+parent_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def add_ingest_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--midifile",
+        type=str,
+        help="path to a midi file. "
+    )
+    parser.add_argument(
+        "--midifolder",
+        type=str,
+        help="path to a folder that contains midi files."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used to parse the midi folder"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-parse every midi file in the folder, ignoring the ingestion manifest"
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="music21",
+        choices=["music21", "fast"],
+        help="midi parser: music21 (reference) or fast (reads the midi tick stream directly)"
+    )
+    parser.add_argument(
+        "--tunestore",
+        type=str,
+        help="parse the midi folder into this content-addressed tune store (see tune_store.py) "
+            "instead of midi_coll/<mood>, each unique tune once"
+    )
+
+def add_augment_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--augment",
+        action="store_true",
+        help="also train the pitch markov on every tune transposed to each key within half an octave"
+    )
+    parser.add_argument(
+        "--register",
+        type=int,
+        nargs=2,
+        metavar=("LOW", "HIGH"),
+        help="only keep the transpositions of --augment whose pitches all lie within LOW..HIGH"
+    )
+
+def check_augment_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.register and not args.augment:
+        parser.error("--register limits the transpositions of --augment")
+    if args.register and args.register[0] > args.register[1]:
+        parser.error("--register LOW must not be above HIGH")
+
+def add_train_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--mood",
+        type=str,
+        help="mood category"
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        help="major or minor mode"
+    )
+    parser.add_argument(
+        "--timesig",
+        type=int,
+        help="the time signature beat count"
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        help="path to a corpus store (see corpus_store.py) to train from instead of the coll files"
+    )
+    parser.add_argument(
+        "--tunestore",
+        type=str,
+        help="directory of a tune store (see tune_store.py) to train from instead of the coll files"
+    )
+    parser.add_argument(
+        "--order",
+        type=int,
+        default=1,
+        help="markov order; above 1, also writes <pitch|onset>_markov_order<N>.npz with back-off to lower orders"
+    )
+    parser.add_argument(
+        "--joint",
+        action="store_true",
+        help="also train a markov of the joint pitch-onset states, stored sparse as joint_markov.model"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="update the count checkpoint with only the new, changed or deleted coll files"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="path of the count checkpoint (default: checkpoints/<mood>_<mode>_<timesig>.npz)"
+    )
+    parser.add_argument(
+        "--colldir",
+        type=str,
+        default=os.path.join(parent_dir, "midi_coll"),
+        help="root directory of the coll files to train on"
+    )
+    parser.add_argument(
+        "--outdir",
+        type=str,
+        default=parent_dir,
+        help="directory to write pitch_markov.txt and onset_markov.txt (and their .model files) to"
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="train every mood/mode/timesig combination in one pass into the model bank"
+    )
+    parser.add_argument(
+        "--bank",
+        type=str,
+        default=os.path.join(parent_dir, "model_bank"),
+        help="directory of the model bank written by --all (one directory per combination plus index.json)"
+    )
+    add_augment_arguments(parser)
+
+def check_train_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.store and args.tunestore:
+        parser.error("--store and --tunestore are two sources of tunes, pick one")
+    if args.incremental and (args.store or args.tunestore):
+        parser.error("--incremental tracks the coll files and cannot be combined with --store or --tunestore")
+    if args.incremental and args.augment:
+        parser.error("--augment is not kept in the count checkpoint and cannot be combined with --incremental")
+    check_augment_arguments(parser, args)
+
+def add_evaluate_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--mood",
+        type=str,
+        required=True,
+        help="mood category"
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        help="major or minor mode"
+    )
+    parser.add_argument(
+        "--timesig",
+        type=int,
+        help="the time signature beat count"
+    )
+    parser.add_argument(
+        "--colldir",
+        type=str,
+        default=os.path.join(parent_dir, "midi_coll"),
+        help="root directory of the coll files to evaluate on"
+    )
+    parser.add_argument(
+        "--folds",
+        type=int,
+        default=5,
+        help="number of folds; each is held out once and scored by the markovs trained on the others"
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.1,
+        help="add-alpha smoothing of the counts, so unseen transitions keep a small probability"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="random seed of the fold split"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes the folds are evaluated in"
+    )
+    add_augment_arguments(parser)
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="path of the JSON report (default: printed)"
+    )
+
+def check_evaluate_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.folds < 2:
+        parser.error("--folds must be at least 2")
+    if args.alpha <= 0:
+        parser.error("--alpha must be positive, or an unseen transition makes the likelihood zero")
+    check_augment_arguments(parser, args)
+    if not os.path.isdir(os.path.join(args.colldir, args.mood)):
+        parser.error(f"no mood directory {args.mood} in {args.colldir}")
+    from train import get_modes, list_coll_files
+    num_tunes = len(list_coll_files(args.colldir, args.mood, get_modes(args.mode), args.timesig))
+    if num_tunes < args.folds:
+        parser.error(f"{num_tunes} tunes match --mood {args.mood} --mode {args.mode or 'both'} "
+            f"--timesig {args.timesig or 'any'}, fewer than the {args.folds} folds")
+
+def add_repeat_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "filepath",
+        type=str,
+        help="path to the collection file"
+    )
+    parser.add_argument(
+        "startindex",
+        type=int,
+        help="the starting index (inclusive) of the statement to repeat"
+    )
+    parser.add_argument(
+        "endindex",
+        type=int,
+        help="the ending index (exclusive) of the statement to repeat"
+    )
+    parser.add_argument(
+        "timesig",
+        type=int,
+        help="the time signature beat count"
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="directory of a phrase cache: the same coll, statement and parameters reuse the stored tidy result"
+    )
+
+def add_sequence_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "filepath",
+        type=str,
+        help="path to the collection file"
+    )
+    parser.add_argument(
+        "startindex",
+        type=int,
+        help="the starting index (inclusive) of the statement for the sequence"
+    )
+    parser.add_argument(
+        "endindex",
+        type=int,
+        help="the ending index (exclusive) of the statement for the sequence"
+    )
+    parser.add_argument(
+        "endpitch",
+        type=int,
+        help="the new ending note of the sequence"
+    )
+    parser.add_argument(
+        "timesig",
+        type=int,
+        help="the time signature beat count"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="random seed for the out-of-scale first note, for reproducible sequences"
+    )
+    parser.add_argument(
+        "--targets",
+        type=str,
+        choices=["pitches", "degrees"],
+        help="audition mode: write the sequence for every end pitch within an octave of endpitch (pitches) "
+            "or for the closest end pitch of every scale degree (degrees) instead of changing the coll"
+    )
+    parser.add_argument(
+        "--outdir",
+        type=str,
+        help="directory of the audition colls (default: next to the collection file)"
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="directory of a phrase cache: the same coll, statement, parameters and --seed reuse the stored "
+            "tidy result (not used without --seed)"
+    )
+
+def add_tidy_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "filepath",
+        type=str,
+        help="path to the collection file to tidy up"
+    )
+    parser.add_argument(
+        "startindex",
+        type=int,
+        help="the starting index of the statement to tidy up"
+    )
+    parser.add_argument(
+        "timesig",
+        type=int,
+        help="the time signature beat count"
+    )
+
+
+def add_batch_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="json or csv manifest of coll files and the repeat/sequence/tidy operations to chain on each"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes the coll files' chains are run in"
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        help="write the json summary (per file: operations, notes, groups, seconds, error) to this path"
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="directory of a phrase cache shared by the workers (sequences only with a seed)"
+    )
+
+
+# subcommand => (module whose main(args) runs it, help, argument definitions)
+# the module is only imported once its subcommand is chosen, so e.g. tidy never loads numpy or music21
+subcommands = {
+    "ingest": ("write_midi_coll", "parse midi files into Max colls", add_ingest_arguments),
+    "train": ("train", "train the pitch and onset markovs", add_train_arguments),
+    "evaluate": ("evaluate", "score the markovs by k-fold held-out log-likelihood", add_evaluate_arguments),
+    "repeat": ("repetition", "repeat a statement of a coll and tidy it up", add_repeat_arguments),
+    "sequence": ("sequence", "add a diatonic sequence of a statement and tidy it up", add_sequence_arguments),
+    "tidy": ("tidyup_coll", "tidy up a coll into measures and groups", add_tidy_arguments),
+    "batch": ("batch", "run the operation chains of a manifest over many colls in parallel", add_batch_arguments),
+}
+
+# extra validation that argparse cannot express
+argument_checks = {
+    "train": check_train_arguments,
+    "evaluate": check_evaluate_arguments,
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Ghibli melody generation tools")
+    parser.add_argument(
+        "--instrument",
+        type=str,
+        metavar="PATH",
+        help="append per-stage timers and counters as JSON lines to PATH (- for stderr)"
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+    for name, (module_name, help, add_arguments) in subcommands.items():
+        add_arguments(commands.add_parser(name, help=help))
+    return parser
+
+def main(argv: list = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command in argument_checks:
+        argument_checks[args.command](parser, args)
+    if args.instrument:
+        import instrument
+        # through the environment, so that worker processes report as well
+        os.environ[instrument.env_var] = args.instrument
+        instrument.enable(args.instrument)
+    module = importlib.import_module(subcommands[args.command][0])
+    module.main(args)
+
+
+if __name__ == "__main__":
+    main()
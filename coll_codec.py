@@ -0,0 +1,133 @@
+from array import array
+
+# the Max coll formats: notes "i, onset pitch dur vel;" and groups "i, num;", one per line.
+# a buffer is parsed in one pass (separators translated to spaces, one split, one int
+# conversion) instead of line by line; numpy is only imported for large buffers, so that
+# tidying a coll from Max stays numpy-free
+note_format = "%d, %d %d %d %d;\n"
+group_format = "%d, %d;\n"
+num_fields = 5
+separators = bytes.maketrans(b",;", b"  ")
+# buffers from this size on are parsed with numpy (its import costs about as much as a
+# megabyte of pure python parsing)
+numpy_threshold = 1 << 20
+int32_range = (-2 ** 31, 2 ** 31 - 1)
+
+
+def check_line(line: bytes, fields: int) -> bool:
+    """ whether a line is a well formed coll line of that many fields """
+    props = line.split()
+    if len(props) != fields or not props[0].endswith(b",") or not props[-1].endswith(b";"):
+        return False
+    try:
+        [int(prop) for prop in [props[0][:-1]] + props[1:-1] + [props[-1][:-1]]]
+    except ValueError:
+        return False
+    return True
+
+def bad_line(data: bytes, fields: int, name: str) -> ValueError:
+    """ the error pointing at the first malformed line of a buffer that failed the bulk checks """
+    for line_num, line in enumerate(data.splitlines(), 1):
+        if line.strip() and not check_line(line, fields):
+            return ValueError(f"{name}, line {line_num}: not a coll line of {fields} fields: {line.decode(errors='replace')!r}")
+    return ValueError(f"{name}: not a coll of {fields} fields")
+
+def validate(data: bytes, num_values: int, fields: int, name: str) -> int:
+    """ number of lines of a parsed buffer; every line has to hold one index, one ',' and one ';' """
+    num_lines = data.count(b";")
+    if num_values != num_lines * fields or data.count(b",") != num_lines:
+        raise bad_line(data, fields, name)
+    return num_lines
+
+
+def parse_array(data: bytes, fields: int = num_fields, name: str = "coll"):
+    """ (lines, fields) int64 array of a coll buffer, e.g. index, onset, pitch, dur, vel columns """
+    import warnings
+    import numpy as np
+
+    translated = data.translate(separators)
+    values = np.zeros(0, dtype=np.int64)
+    if translated.strip():
+        # fromstring stops (with a warning) at the first token that is not an int, which the count check catches
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(translated, dtype=np.int64, sep=" ")
+    num_lines = validate(data, values.size, fields, name)
+    return values.reshape(num_lines, fields)
+
+def parse(data: bytes, fields: int = num_fields, name: str = "coll") -> tuple:
+    """ the columns of a coll buffer, as int arrays (array('i')) """
+    if len(data) >= numpy_threshold:
+        values = parse_array(data, fields, name)
+        if values.size and (values.min() < int32_range[0] or values.max() > int32_range[1]):
+            raise OverflowError(f"{name}: value out of the int range of a coll column")
+        return tuple(array("i", values[:, k].astype("i4").tobytes()) for k in range(fields))
+    try:
+        # a list first: array() from a map is slower than from a list
+        values = array("i", list(map(int, data.translate(separators).split())))
+    except ValueError:
+        raise bad_line(data, fields, name) from None
+    validate(data, len(values), fields, name)
+    return tuple(values[k::fields] for k in range(fields))
+
+def read(coll_fp: str) -> tuple:
+    """ index, onset, pitch, dur and vel columns of a coll file """
+    with open(coll_fp, "rb") as rf:
+        return parse(rf.read(), name=coll_fp)
+
+def read_array(coll_fp: str):
+    with open(coll_fp, "rb") as rf:
+        return parse_array(rf.read(), name=coll_fp)
+
+def iter_arrays(coll_fp: str, chunk_size: int = 1 << 22):
+    """ yields parse_array blocks of whole lines, about chunk_size bytes each, for colls too large to read at once """
+    rest = b""
+    with open(coll_fp, "rb") as rf:
+        while True:
+            chunk = rf.read(chunk_size)
+            if not chunk:
+                break
+            cut = chunk.rfind(b"\n") + 1
+            if cut == 0:
+                rest += chunk
+                continue
+            block, rest = rest + chunk[:cut], chunk[cut:]
+            yield parse_array(block, name=coll_fp)
+    if rest.strip():
+        yield parse_array(rest, name=coll_fp)
+
+
+def interleave(columns: tuple) -> tuple:
+    """ the values of the columns row by row, as the % format of many lines takes them """
+    num_lines = len(columns[0])
+    flat = [0] * (num_lines * len(columns))
+    for k, column in enumerate(columns):
+        if len(column) != num_lines:
+            raise ValueError("coll columns differ in length")
+        flat[k::len(columns)] = column
+    return tuple(flat)
+
+def format_notes(index, onset, pitch, dur, vel) -> str:
+    """ the note lines of the columns, formatted in one go """
+    return note_format * len(index) % interleave((index, onset, pitch, dur, vel))
+
+def format_groups(groups, start: int = 0) -> str:
+    """ the group lines of the group sizes, numbered from start """
+    return group_format * len(groups) % interleave((range(start, start + len(groups)), groups))
+
+def last_line_offset(text: str) -> int:
+    """ offset of the start of the last line of formatted (ascii) lines, 0 when there is at most one """
+    return text.rfind("\n", 0, len(text) - 1) + 1
+
+def write(coll_fp: str, index, onset, pitch, dur, vel):
+    with open(coll_fp, "w") as wf:
+        wf.write(format_notes(index, onset, pitch, dur, vel))
+
+def read_groups(group_fp: str) -> array:
+    """ the group sizes of a group_* file """
+    with open(group_fp, "rb") as rf:
+        return parse(rf.read(), fields=2, name=group_fp)[1]
+
+def write_groups(group_fp: str, groups):
+    with open(group_fp, "w") as wf:
+        wf.write(format_groups(groups))
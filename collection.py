@@ -0,0 +1,514 @@
+import json
+import os
+import random
+from array import array
+
+import coll_codec
+import instrument
+from Note import NoteArray
+from constants import tick_quarter
+from transposition import transpose_all, transpose_statement
+
+
+def read_notes(coll_filepath: str) -> NoteArray:
+    return NoteArray._wrap(*coll_codec.read(coll_filepath))
+
+def write_notes(coll_filepath: str, notes: NoteArray):
+    coll_codec.write(coll_filepath, *notes.columns())
+
+def rewrite_tail(filepath: str, offset: int, text: str) -> int:
+    """ replace everything from byte offset on with the (ascii) lines of text; returns the offset of the last line """
+    with open(filepath, "r+b") as f:
+        f.seek(offset)
+        f.truncate()
+        f.write(text.encode())
+    return offset + coll_codec.last_line_offset(text)
+
+def read_note_rows(rows_filepath: str) -> NoteArray:
+    """ the notes of a file of raw int rows (index, onset, pitch, dur, vel) """
+    rows = array("i")
+    with open(rows_filepath, "rb") as f:
+        rows.frombytes(f.read())
+    return NoteArray._wrap(*(rows[k::coll_codec.num_fields] for k in range(coll_codec.num_fields)))
+
+def write_note_rows(rows_filepath: str, notes: NoteArray, first: int = 0):
+    """ (re)write the raw rows of the notes from note first on, keeping the rows before it """
+    row_bytes = coll_codec.num_fields * array("i").itemsize
+    with open(rows_filepath, "r+b" if first and os.path.exists(rows_filepath) else "wb") as f:
+        f.seek(first * row_bytes)
+        f.truncate()
+        f.write(array("i", coll_codec.interleave(notes[first:].columns())).tobytes())
+
+def file_stat(filepath: str) -> list:
+    st = os.stat(filepath)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class TidyState:
+    """
+    running state of tidying a coll: the tidied notes, the closed groups, the open group
+    and the index offset, so that appended notes can be tidied without redoing the rest
+    """
+
+    def __init__(self, time_sig: int):
+        self.time_sig = time_sig
+        self.measure_tick = tick_quarter * time_sig
+        self.tidy_notes = NoteArray()
+        self.groups = []
+        self.group_num = 0
+        self.index_offset = 0
+        # number of coll notes consumed
+        self.num_raw = 0
+        # ties and rests inserted
+        self.ties = 0
+        self.rests = 0
+        # whether the consumed coll notes are the tidy notes themselves (a tidy_* coll edited in place)
+        self.raw_is_tidy = False
+
+    def keep(self, coll_note: tuple, verbose: bool = False):
+        """ add an already tidy-ed note (from last tidyup) """
+        i, onset, pitch, dur, vel = coll_note
+        if verbose:
+            print("not in the scope of tidying up")
+        if self.tidy_notes and onset == 0:
+            self.groups.append(self.group_num)
+            self.group_num = 0
+        self.tidy_notes.append(i + self.index_offset, onset, pitch, dur, vel)
+        self.group_num += 1
+        self.num_raw += 1
+
+    def add(self, coll_note: tuple, verbose: bool = False):
+        """ tidy a note: calculate the last note's duration, add rests & ties, and group notes """
+        i, onset, pitch, dur, vel = coll_note
+        measure_tick = self.measure_tick
+        default_dur = measure_tick
+        tidy_notes = self.tidy_notes
+        groups = self.groups
+
+        # if we have a last note...
+        if tidy_notes:
+            last_note = tidy_notes[i + self.index_offset -1]
+            last_onset = last_note.onset
+            if verbose:
+                print(f"last onset: {last_onset}")
+            # condition 1: new measure; no carry-over
+            if onset == 0:
+                if verbose:
+                    print("starting a new measure")
+                # 1) last note dur
+                if last_note.dur > 0:
+                    last_note.update_dur(measure_tick - last_onset)
+                # 2) group last measure
+                groups.append(self.group_num)
+                self.group_num = 0
+
+            # condition 2 (TIE): new measure; carry-over
+            elif onset <= last_onset:
+                if verbose:
+                    print("new measure with a tie")
+                if last_note.dur > 0:
+                    if verbose:
+                        print("creating a tie")
+                    # 1) last note dur in last measure
+                    last_note.update_dur(measure_tick - last_onset)
+                    # 2) new note 1: tie (last measure)
+                    tidy_notes.append(i + self.index_offset, default_dur, 0, 0, 0)
+                    self.index_offset += 1
+                    # 3) new note 2: last note carry-over dur to this measure (this measure)
+                    tidy_notes.append(i + self.index_offset , 0, last_note.pitch, onset, last_note.vel)
+                    self.index_offset += 1
+                    self.ties += 1
+                else:
+                    if verbose:
+                        print("last note is a rest. creating a rest in the current measure.")
+                    # last note was a rest in the previous measure
+                    # we should add a rest in front of the current note (as its onset is not 0)
+                    tidy_notes.append(i + self.index_offset, 0, 0, -1 * onset, 0)
+                    self.index_offset += 1
+                    self.rests += 1
+                # group last measure (add 1 for the tie)
+                groups.append(self.group_num + 1)
+                # reset group_num to 1 because of the added carry-over note / rest
+                self.group_num = 1
+
+            # condition 3: same measure
+            else: # onset > last_onset
+                if verbose:
+                    print("in the same measure as last note")
+                # just update the dur of last note
+                if last_note.dur > 0:
+                    last_note.update_dur(onset - last_onset)
+                    if verbose:
+                        print(f"last note is not a rest. ")
+            if verbose:
+                print(f"last note dur updated to: {last_note.dur}")
+
+        # if this is the first note...
+        else:
+            # add rests at the start
+            if onset != 0:
+                # 1) add rest (negative dur)
+                tidy_notes.append(0, 0, 0, onset * -1, 0)
+                self.index_offset += 1
+                self.rests += 1
+                # 2) reset group_num to 1 because of the added rest
+                self.group_num = 1
+
+        # add current note to list
+        tidy_notes.append(i + self.index_offset, onset, pitch, measure_tick, vel)
+        self.group_num += 1
+        self.num_raw += 1
+
+    def finish(self):
+        """ (tidy notes, groups) with the final note's duration and the open group closed """
+        # update last note's duration
+        # (a later add() recomputes it from the next onset, so the state stays resumable)
+        if not self.tidy_notes:
+            return self.tidy_notes, list(self.groups)
+        final_note = self.tidy_notes[-1]
+        final_note.update_dur(self.measure_tick - final_note.onset)
+        # TODO: RESTS
+        return self.tidy_notes, self.groups + [self.group_num]
+
+    def adopt_tidy(self):
+        """ the coll now holds the tidy notes: continue the coll numbering from them """
+        self.num_raw = len(self.tidy_notes)
+        self.index_offset = 0
+        self.raw_is_tidy = True
+
+    def to_dict(self) -> dict:
+        return {"time_sig": self.time_sig, "groups": self.groups, "group_num": self.group_num,
+            "index_offset": self.index_offset, "num_raw": self.num_raw, "raw_is_tidy": self.raw_is_tidy}
+
+    @classmethod
+    def from_dict(cls, state: dict, tidy_notes: NoteArray) -> "TidyState":
+        tidy_state = cls(state["time_sig"])
+        tidy_state.tidy_notes = tidy_notes
+        tidy_state.groups = state["groups"]
+        tidy_state.group_num = state["group_num"]
+        tidy_state.index_offset = state["index_offset"]
+        tidy_state.num_raw = state["num_raw"]
+        tidy_state.raw_is_tidy = state["raw_is_tidy"]
+        return tidy_state
+
+
+def tidy_state(notes: NoteArray, start_idx: int, time_sig: int, verbose: bool = False) -> TidyState:
+    if verbose:
+        print("start index to tidy up ", start_idx)
+    state = TidyState(time_sig)
+    for coll_note in notes.rows():
+        if verbose:
+            print("on index {}. onset: {}. pitch: {}. dur: {}. vel: {}".format(*coll_note))
+        # for already tidy-ed note (from last tidyup)
+        if coll_note[0] < start_idx:
+            state.keep(coll_note, verbose)
+        else:
+            state.add(coll_note, verbose)
+    return state
+
+def tidy_notes(notes: NoteArray, start_idx: int, time_sig: int, verbose: bool = False):
+    """ calculate durations, add rests & ties, and group notes; returns (tidy notes, groups) """
+    return tidy_state(notes, start_idx, time_sig, verbose).finish()
+
+
+class Collection:
+    """
+    a coll held in memory: load once, chain repeat / sequence / tidy, and only write
+    the coll, tidy_* and group_* files on save()
+    """
+
+    def __init__(self, notes: NoteArray, coll_filepath: str = None, coll_basename: str = None):
+        self.notes = notes
+        self.coll_filepath = coll_filepath
+        if not coll_basename and coll_filepath:
+            coll_basename = os.path.basename(coll_filepath)
+        self.coll_basename = coll_basename
+        self.tidy_notes = None
+        self.groups = None
+        self.tidy_state = None
+        # what the tidy_* / group_* files on disk hold, when the tidy state continues from them
+        self.written = None
+
+    @classmethod
+    def load(cls, coll_filepath: str, coll_basename: str = None) -> "Collection":
+        coll = cls(None, coll_filepath, coll_basename)
+        # a coll we tidied last and nobody touched since is read from its raw rows instead of parsed
+        if not coll.load_tidy_state():
+            coll.notes = read_notes(coll_filepath)
+        return coll
+
+    @property
+    def state_filepath(self) -> str:
+        return os.path.join(os.path.dirname(self.coll_filepath), f".tidystate_{self.coll_basename}.json")
+
+    @property
+    def rows_filepath(self) -> str:
+        return os.path.join(os.path.dirname(self.coll_filepath), f".tidystate_{self.coll_basename}.notes")
+
+    def is_own_tidy(self) -> bool:
+        """ whether the coll is its own tidy_* file, i.e. the tidy output replaces the coll """
+        return bool(self.coll_filepath) and \
+            os.path.abspath(self.tidy_filepath) == os.path.abspath(self.coll_filepath)
+
+    def saved_files(self) -> list:
+        return [file_stat(fp) if os.path.exists(fp) else None
+            for fp in [self.tidy_filepath, self.group_filepath, self.rows_filepath]]
+
+    def load_tidy_state(self) -> bool:
+        """ take the notes and tidy state from the last save, if the tidy/group files are untouched since """
+        if not self.is_own_tidy() or not os.path.exists(self.state_filepath):
+            return False
+        with open(self.state_filepath) as f:
+            saved = json.load(f)
+        if saved["files"] != self.saved_files():
+            return False
+        notes = read_note_rows(self.rows_filepath)
+        if saved["state"]["num_raw"] != len(notes):
+            return False
+        self.notes = notes
+        self.tidy_state = TidyState.from_dict(saved["state"], notes.copy())
+        self.written = saved["written"]
+        return True
+
+    def save_tidy_state(self, first: int = 0):
+        # the rows mirror the tidy file, which is the coll: only rewritten from its first changed note
+        write_note_rows(self.rows_filepath, self.tidy_notes, first)
+        saved = {
+            "state": self.tidy_state.to_dict(),
+            "written": self.written,
+            "files": self.saved_files(),
+        }
+        with open(self.state_filepath, "w") as f:
+            json.dump(saved, f)
+
+    @property
+    def tidy_filepath(self) -> str:
+        return os.path.join(os.path.dirname(self.coll_filepath), f"tidy_{self.coll_basename}")
+
+    @property
+    def group_filepath(self) -> str:
+        return os.path.join(os.path.dirname(self.coll_filepath), f"group_{self.coll_basename}")
+
+    def repeat(self, start_idx: int, end_idx: int) -> "Collection":
+        notes = self.notes
+        offset = len(notes) - start_idx
+
+        # repeat notes
+        for index, onset, pitch, dur, vel in notes.rows(start_idx, end_idx):
+            new_idx = index + offset
+            # since the rest in a statement can only be at the beginning,
+            # we simply remove the rest, so that we would extend the last note during tidy-up
+            if dur < 0:
+                offset -= 1
+                continue
+            notes.append(new_idx, onset, pitch, dur, vel)
+        return self
+
+    def sequence(self, start_idx: int, end_idx: int, endpitch: int, rng: random.Random = random) -> "Collection":
+        notes = self.notes
+        statement = notes[start_idx:end_idx]
+        new_pitches = transpose_statement(statement.pitch, statement.dur, endpitch, notes.pitch[-1], rng)
+        self.append_sequence(statement, new_pitches, len(notes) - start_idx)
+        return self
+
+    def append_sequence(self, statement: NoteArray, new_pitches: list, offset: int):
+        # the rests of the statement have no new pitch: they are dropped
+        new_pitches = iter(new_pitches)
+        for index, onset, pitch, dur, vel in statement.rows():
+            if dur < 0:
+                offset -= 1
+                continue
+            self.notes.append(index + offset, onset, next(new_pitches), dur, vel)
+
+    def sequence_variants(self, start_idx: int, end_idx: int, endpitches: list, seed: int = None,
+        coll_dir: str = None) -> list:
+        """ a new Collection (<coll_dir>/<basename>_seq<endpitch>) per end pitch, each with the statement sequenced to it """
+        if coll_dir is None:
+            coll_dir = os.path.dirname(self.coll_filepath or "")
+        notes = self.notes
+        statement = notes[start_idx:end_idx]
+        all_pitches = transpose_all(statement.pitch, statement.dur, endpitches, notes.pitch[-1], seed)
+        variants = []
+        for endpitch, new_pitches in zip(endpitches, all_pitches.tolist()):
+            coll_basename = f"{self.coll_basename}_seq{endpitch}"
+            coll_filepath = os.path.join(coll_dir, coll_basename)
+            variant = Collection(notes.copy(), coll_filepath, coll_basename)
+            variant.append_sequence(statement, new_pitches, len(notes) - start_idx)
+            variants.append(variant)
+        return variants
+
+    def cached(self, cache, op: tuple, transform, rng=None) -> "Collection":
+        """
+        transform(self), a repeat / sequence of op (name, start, end, ..., time_sig) ending in a tidy
+        from end - 1, or its stored result when the cache (a phrase_cache.PhraseCache, or None for no
+        caching) has already seen the same inputs; the random state after the transform is restored as well
+        """
+        if cache is None:
+            return transform(self)
+        rng_state = cache.random_state(rng) if rng else None
+        if self.appends_phrase(op):
+            return self.cached_phrase(cache, op, transform, rng, rng_state)
+        key = cache.key(op, self.is_own_tidy(), rng_state, *(column.tobytes() for column in self.notes.columns()))
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            self.restore(snapshot, rng)
+            return self
+        transform(self)
+        cache.put(key, self.snapshot(rng))
+        return self
+
+    def appends_phrase(self, op: tuple) -> bool:
+        """
+        whether op reads nothing but its statement, the last tidy note and the open group: a statement
+        ending the coll, which is its own tidy_* file with a current tidy state, and numbered in order
+        """
+        state = self.tidy_state
+        start_idx, end_idx, time_sig = op[1], op[2], op[-1]
+        num_notes = len(self.notes)
+        return state is not None and self.is_own_tidy() and state.raw_is_tidy and state.time_sig == time_sig \
+            and state.index_offset == 0 and state.num_raw == num_notes == len(state.tidy_notes) \
+            and 0 <= start_idx < end_idx == num_notes \
+            and self.notes.index[start_idx:] == array("i", range(start_idx, end_idx))
+
+    def cached_phrase(self, cache, op: tuple, transform, rng, rng_state: bytes) -> "Collection":
+        """
+        cached() of a statement ending the coll: keyed by the statement, not its position or the rest of
+        the coll, and stored as the appended tidy notes (numbered from the coll's length) and groups
+        """
+        state = self.tidy_state
+        statement = self.notes[op[1]:op[2]]
+        last_tidy = state.tidy_notes.row(len(state.tidy_notes) - 1)[1:]
+        key = cache.key("phrase", op[0], op[3:], rng_state, last_tidy, state.group_num,
+            *(column.tobytes() for column in statement.columns()[1:]))
+        num_notes, num_groups = len(self.notes), len(state.groups)
+        phrase = cache.get(key)
+        if phrase is not None:
+            appended = NoteArray.from_columns([i + num_notes for i in phrase["notes"][0]], *phrase["notes"][1:])
+            for notes in [self.notes, state.tidy_notes]:
+                notes[num_notes - 1].update_dur(phrase["last_dur"])
+                notes.extend(appended)
+            state.groups.extend(phrase["groups"])
+            state.group_num = phrase["group_num"]
+            state.adopt_tidy()
+            self.tidy_notes, self.groups = state.finish()
+            if rng:
+                version, internal, gauss_next = phrase["rng"]
+                rng.setstate((version, tuple(internal), gauss_next))
+            return self
+        transform(self)
+        # the transform continued the same state, as appends_phrase promised
+        if self.tidy_state is state:
+            appended = state.tidy_notes[num_notes:]
+            cache.put(key, {
+                "notes": [array("i", [i - num_notes for i in appended.index])] + list(appended.columns()[1:]),
+                "last_dur": state.tidy_notes.dur[num_notes - 1],
+                "groups": state.groups[num_groups:],
+                "group_num": state.group_num,
+                "rng": rng.getstate() if rng else None,
+            })
+        return self
+
+    def snapshot(self, rng=None) -> dict:
+        """ copies of the notes and tidy state, with the state of rng """
+        return {
+            "notes": [column[:] for column in self.notes.columns()],
+            "tidy_notes": [column[:] for column in self.tidy_state.tidy_notes.columns()],
+            # the groups list keeps growing with the state
+            "state": dict(self.tidy_state.to_dict(), groups=list(self.tidy_state.groups)),
+            "rng": rng.getstate() if rng else None,
+        }
+
+    def restore(self, snapshot: dict, rng=None):
+        self.notes = NoteArray.from_columns(*snapshot["notes"])
+        state = dict(snapshot["state"], groups=list(snapshot["state"]["groups"]))
+        self.tidy_state = TidyState.from_dict(state, NoteArray.from_columns(*snapshot["tidy_notes"]))
+        self.tidy_notes, self.groups = self.tidy_state.finish()
+        # the files on disk do not hold what this state continues from
+        self.written = None
+        if rng:
+            version, internal, gauss_next = snapshot["rng"]
+            rng.setstate((version, tuple(internal), gauss_next))
+
+    def tidy(self, start_idx: int, time_sig: int, verbose: bool = False) -> "Collection":
+        with instrument.timer("tidy", notes=len(self.notes)):
+            return self._tidy(start_idx, time_sig, verbose)
+
+    def _tidy(self, start_idx: int, time_sig: int, verbose: bool = False) -> "Collection":
+        state = self.tidy_state
+        num_raw, ties, rests = 0, 0, 0
+        # when everything before start_idx is already tidy, only the appended notes are processed;
+        # re-tidying the last tidy note only recomputes its duration, which add() does as well
+        if state is not None and state.raw_is_tidy and state.time_sig == time_sig and \
+            state.num_raw - 1 <= start_idx and state.num_raw <= len(self.notes):
+            num_raw, ties, rests = state.num_raw, state.ties, state.rests
+            num_tidy = len(state.tidy_notes)
+            if start_idx < state.num_raw and state.tidy_notes:
+                # the last tidy note is in scope again: like add(), it restarts from a full measure
+                state.tidy_notes[-1].update_dur(state.measure_tick)
+            for coll_note in self.notes.rows(state.num_raw):
+                if coll_note[0] < start_idx:
+                    state.keep(coll_note, verbose)
+                else:
+                    state.add(coll_note, verbose)
+        else:
+            state = tidy_state(self.notes, start_idx, time_sig, verbose)
+            num_tidy = 0
+            self.written = None
+        self.tidy_state = state
+        self.tidy_notes, self.groups = state.finish()
+        instrument.count("tidy.notes", state.num_raw - num_raw)
+        instrument.count("tidy.ties", state.ties - ties)
+        instrument.count("tidy.rests", state.rests - rests)
+
+        # tidying a tidy_* coll in place: the tidy output is the new content of the coll
+        if self.is_own_tidy():
+            # from the previous last tidy note on, whose duration the appended notes may have changed
+            del self.notes[max(num_tidy - 1, 0):]
+            self.notes.extend(self.tidy_notes[len(self.notes):])
+            state.adopt_tidy()
+        return self
+
+    def write_tidy(self) -> int:
+        """ write the tidy_* and group_* files; returns the first tidy note written """
+        written = self.written
+        if written is not None and written["tidy_lines"] > 0:
+            # the files hold the output of the state we continued from: only rewrite from
+            # the previous last note (its duration may have changed) and the open group on
+            first = written["tidy_lines"] - 1
+            tidy_last_offset = rewrite_tail(self.tidy_filepath, written["tidy_last_offset"],
+                coll_codec.format_notes(*self.tidy_notes[first:].columns()))
+            closed = written["closed_groups"]
+            group_open_offset = rewrite_tail(self.group_filepath, written["group_open_offset"],
+                coll_codec.format_groups(self.groups[closed:], closed))
+        else:
+            first = 0
+            tidy_text = coll_codec.format_notes(*self.tidy_notes.columns())
+            group_text = coll_codec.format_groups(self.groups)
+            with open(self.tidy_filepath, "w") as f:
+                f.write(tidy_text)
+            with open(self.group_filepath, "w") as f:
+                f.write(group_text)
+            tidy_last_offset = coll_codec.last_line_offset(tidy_text)
+            group_open_offset = coll_codec.last_line_offset(group_text)
+        self.written = {
+            "tidy_lines": len(self.tidy_notes),
+            "tidy_last_offset": tidy_last_offset,
+            "closed_groups": max(len(self.groups) - 1, 0),
+            "group_open_offset": group_open_offset,
+        }
+        return first
+
+    def save(self, write_coll: bool = True):
+        with instrument.timer("coll.write", notes=len(self.notes)):
+            self._save(write_coll)
+
+    def _save(self, write_coll: bool = True):
+        # a coll that is its own tidy_* file is written by the tidy output
+        own_tidy = self.tidy_notes is not None and self.is_own_tidy()
+        if write_coll and not own_tidy:
+            write_notes(self.coll_filepath, self.notes)
+        if self.tidy_notes is not None:
+            print(self.groups)
+            first = self.write_tidy()
+            if own_tidy:
+                self.save_tidy_state(first)
@@ -0,0 +1,54 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+
+import fast_midi_coll
+import write_midi_coll
+
+
+def main(args):
+    midi_folder = args.midifolder
+    mismatches = []
+    num_files = 0
+
+    with tempfile.TemporaryDirectory() as ref_dir, tempfile.TemporaryDirectory() as fast_dir:
+        for dir_name in sorted(os.listdir(midi_folder)):
+            if dir_name.startswith('.'):
+                continue
+            os.makedirs(os.path.join(ref_dir, dir_name))
+            os.makedirs(os.path.join(fast_dir, dir_name))
+            for file_name in sorted(os.listdir(os.path.join(midi_folder, dir_name))):
+                if file_name.startswith('.'):
+                    continue
+                fp = os.path.join(midi_folder, dir_name, file_name)
+                num_files += 1
+                # parse with both backends; both must produce the same coll, or both discard the file
+                ref_fp = write_midi_coll.parse_file(fp, coll_dir=ref_dir)
+                fast_fp = fast_midi_coll.parse_file(fp, coll_dir=fast_dir)
+                if ref_fp is None or fast_fp is None:
+                    if (ref_fp is None) != (fast_fp is None):
+                        mismatches.append(fp)
+                elif not filecmp.cmp(ref_fp, fast_fp, shallow=False):
+                    mismatches.append(fp)
+
+    for fp in mismatches:
+        print(f"mismatch: {fp}")
+    print(f"{num_files - len(mismatches)}/{num_files} midi files parsed identically")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the music21 and fast midi parsers write identical colls")
+    parser.add_argument(
+        "--midifolder",
+        type=str,
+        default="midi",
+        help="path to a folder that contains mood folders of midi files"
+    )
+
+    args = parser.parse_args()
+    sys.exit(main(args))
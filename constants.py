@@ -0,0 +1,12 @@
+# shared by the parsing, training and coll transformation scripts
+
+# tick of a quarter note
+tick_quarter = 12
+# quantization grid used when parsing midi (divisions of a quarter note)
+quarter_length_divisors = [12, 16]
+# midi numbers 0..107 are the pitch states
+num_pitches = 108
+# onset ticks within a 4 beat measure are the onset states
+num_onsets = tick_quarter * 4
+# a joint pitch-onset state is pitch * num_onsets + onset
+num_joint_states = num_pitches * num_onsets
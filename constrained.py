@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class InfeasibleConstraints(ValueError):
+    """ no phrase of the wanted length satisfies the masks """
+
+
+def step_masks(num_states: int, length: int, allowed: np.ndarray = None, end: np.ndarray = None) -> np.ndarray:
+    """
+    (length, num_states) bool array of the states allowed at each step: allowed (e.g. a register)
+    at every step, and also end at the last one
+    """
+    masks = np.ones((length, num_states), dtype=bool)
+    if allowed is not None:
+        masks &= np.asarray(allowed, dtype=bool)
+    if end is not None and length:
+        masks[-1] &= np.asarray(end, dtype=bool)
+    return masks
+
+
+class ConstrainedSampler:
+    """
+    first-order markov sampling conditioned on per-step state masks.
+
+    the backward pass computes, for every step and state, the (rescaled) probability that a
+    phrase continuing from it satisfies the remaining masks; sampling each next state in
+    proportion to transition * that weight then draws exactly from the conditioned distribution,
+    with no rejection, in O(length * states^2) however rare the constraint
+    """
+
+    def __init__(self, init: np.ndarray, trans: np.ndarray):
+        self.num_states = init.size
+        self.init = np.asarray(init, dtype=np.float64)
+        # states without any transition restart from the initial distribution, as MarkovSampler does
+        trans = np.array(trans, dtype=np.float64)
+        empty = trans.sum(axis=1) == 0
+        trans[empty] = self.init
+        self.trans = trans
+
+    def backward(self, masks: np.ndarray) -> np.ndarray:
+        """ (length, states) weights: beta[t, s] is proportional to P(steps t+1.. satisfy the masks | s at t), 0 where s is masked out """
+        length = masks.shape[0]
+        beta = np.zeros(masks.shape)
+        if length == 0:
+            return beta
+        beta[-1] = masks[-1]
+        for t in range(length - 2, -1, -1):
+            weights = (self.trans @ beta[t + 1]) * masks[t]
+            # rescaled at every step so that long phrases do not underflow
+            top = weights.max()
+            beta[t] = weights / top if top > 0 else weights
+        return beta
+
+    def sample(self, masks: np.ndarray, num_melodies: int, rng: np.random.Generator) -> np.ndarray:
+        """ (num_melodies, length) array of states, each phrase drawn from the markov conditioned on the masks """
+        length = masks.shape[0]
+        states = np.zeros((num_melodies, length), dtype=np.int64)
+        if length == 0:
+            return states
+        beta = self.backward(masks)
+        first = self.init * beta[0]
+        if not first.any():
+            raise InfeasibleConstraints(f"no phrase of {length} notes satisfies the constraints")
+        states[:, 0] = self.draw(np.broadcast_to(first, (num_melodies, self.num_states)), rng)
+        for t in range(1, length):
+            states[:, t] = self.draw(self.trans[states[:, t - 1]] * beta[t], rng)
+        return states
+
+    @staticmethod
+    def draw(weights: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """ one state per row, in proportion to the row's weights """
+        cdf = np.cumsum(weights, axis=1)
+        u = rng.random(weights.shape[0]) * cdf[:, -1]
+        # states with zero weight are never chosen: only strictly increasing cdf steps can exceed u
+        return np.minimum((cdf <= u[:, None]).sum(axis=1), weights.shape[1] - 1)
+
+    def viterbi(self, masks: np.ndarray) -> np.ndarray:
+        """ the single most likely phrase satisfying the masks, in O(length * states^2) """
+        length = masks.shape[0]
+        if length == 0:
+            return np.zeros(0, dtype=np.int64)
+        with np.errstate(divide="ignore"):
+            log_trans = np.log(self.trans)
+            log_masks = np.log(masks.astype(np.float64))
+            score = np.log(self.init) + log_masks[0]
+        back = np.zeros((length, self.num_states), dtype=np.int64)
+        for t in range(1, length):
+            # candidates[s', s]: best phrase ending s' -> s
+            candidates = score[:, None] + log_trans
+            back[t] = candidates.argmax(axis=0)
+            score = candidates[back[t], np.arange(self.num_states)] + log_masks[t]
+        if not np.isfinite(score.max()):
+            raise InfeasibleConstraints(f"no phrase of {length} notes satisfies the constraints")
+        path = np.zeros(length, dtype=np.int64)
+        path[-1] = score.argmax()
+        for t in range(length - 1, 0, -1):
+            path[t - 1] = back[t, path[t]]
+        return path
@@ -0,0 +1,162 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import json
+import os
+import numpy as np
+
+import coll_codec
+
+# file layout: magic, header length (8 bytes, little endian), json header, aligned arrays
+magic = b"GHIBCORP"
+alignment = 64
+
+parent_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_coll_columns(coll_fp: str):
+    """ onset, pitch and vel columns of a coll file, as int arrays """
+    notes = coll_codec.read_array(coll_fp)
+    return notes[:, 1], notes[:, 2], notes[:, 4]
+
+
+def write_store(store_fp: str, arrays: dict, header: dict, magic: bytes = magic):
+    # place each array at an aligned offset after the header so it can be memory mapped
+    entries = {}
+    offset = 0
+    for name, arr in arrays.items():
+        entries[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // alignment) * alignment
+    header = dict(header, arrays=entries)
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(magic) + 8 + len(header_bytes)) // alignment) * alignment
+    with open(store_fp, "wb") as wf:
+        wf.write(magic)
+        wf.write(len(header_bytes).to_bytes(8, "little"))
+        wf.write(header_bytes)
+        for name, arr in arrays.items():
+            wf.seek(data_start + entries[name]["offset"])
+            wf.write(np.ascontiguousarray(arr).tobytes())
+        # pad to the end of the last array
+        wf.truncate(data_start + offset)
+
+
+def map_store(store_fp: str, magic: bytes = magic):
+    """ the json header and read-only memory maps of the arrays of a file written by write_store """
+    with open(store_fp, "rb") as rf:
+        if rf.read(len(magic)) != magic:
+            raise ValueError(f"{store_fp} is not a {magic.decode()} file")
+        header_len = int.from_bytes(rf.read(8), "little")
+        header = json.loads(rf.read(header_len))
+    data_start = -(-(len(magic) + 8 + header_len) // alignment) * alignment
+
+    arrays = {}
+    for name, entry in header.pop("arrays").items():
+        shape = tuple(entry["shape"])
+        if 0 in shape:
+            arrays[name] = np.zeros(shape, dtype=entry["dtype"])
+        else:
+            arrays[name] = np.memmap(store_fp, dtype=entry["dtype"], mode="r",
+                offset=data_start + entry["offset"], shape=shape)
+    return header, arrays
+
+
+def build_store(coll_dir: str, store_fp: str):
+    names = []
+    moods = []
+    tune_moods = []
+    tune_modes = []
+    tune_timesigs = []
+    onsets = []
+    pitches = []
+    vels = []
+    offsets = [0]
+
+    for mood in sorted(os.listdir(coll_dir)):
+        mood_dir = os.path.join(coll_dir, mood)
+        if mood.startswith('.') or not os.path.isdir(mood_dir):
+            continue
+        for f in sorted(os.listdir(mood_dir)):
+            # look at valid txt files
+            if not f.endswith('.txt') or f.startswith('.'):
+                continue
+            # from the file name, extract the mode and time signature info
+            fname = os.path.splitext(f)[0]
+            if fname[-2] not in "+-" or not fname[-1].isdigit():
+                continue
+            if mood not in moods:
+                moods.append(mood)
+            tune_onsets, tune_pitches, tune_vels = read_coll_columns(os.path.join(mood_dir, f))
+            names.append(fname)
+            tune_moods.append(moods.index(mood))
+            tune_modes.append(fname[-2])
+            tune_timesigs.append(int(fname[-1]))
+            onsets.append(tune_onsets)
+            pitches.append(tune_pitches)
+            vels.append(tune_vels)
+            offsets.append(offsets[-1] + len(tune_pitches))
+
+    empty = [np.zeros(0, dtype=np.int64)]
+    arrays = {
+        "pitch": np.concatenate(pitches or empty).astype(np.int16),
+        "onset": np.concatenate(onsets or empty).astype(np.int16),
+        "vel": np.concatenate(vels or empty).astype(np.int16),
+        "offsets": np.array(offsets, dtype=np.int64),
+        "mood": np.array(tune_moods, dtype=np.int16),
+        "mode": np.array(tune_modes, dtype="S1"),
+        "timesig": np.array(tune_timesigs, dtype=np.int8),
+    }
+    write_store(store_fp, arrays, {"names": names, "moods": moods})
+    print(f"written {store_fp}: {len(names)} tunes, {offsets[-1]} notes")
+
+
+class CorpusStore:
+    """ memory-mapped corpus: note columns of all tunes back to back, sliced by per-tune offsets """
+
+    def __init__(self, store_fp: str):
+        header, arrays = map_store(store_fp)
+        self.names = header["names"]
+        self.moods = header["moods"]
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+
+    def __len__(self):
+        return len(self.names)
+
+    def tune(self, i: int):
+        """ zero-copy (onsets, pitches, vels) views of tune i """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.onset[start:end], self.pitch[start:end], self.vel[start:end]
+
+    def select(self, mood: str, mode: list = ["+", "-"], timesig: int = None) -> list:
+        """ indices of the tunes in the mood with one of the modes and the timesig """
+        if mood not in self.moods:
+            return []
+        mask = self.mood == self.moods.index(mood)
+        mask &= np.isin(self.mode, [m.encode() for m in mode])
+        if timesig is not None:
+            mask &= self.timesig == timesig
+        return list(np.flatnonzero(mask))
+
+
+def main(args):
+    build_store(args.colldir, args.out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a memory-mapped corpus store from the coll files")
+    parser.add_argument(
+        "--colldir",
+        type=str,
+        default=os.path.join(parent_dir, "midi_coll"),
+        help="root directory of the mood folders of coll files"
+    )
+    parser.add_argument(
+        "--out",
+        type=str,
+        default=os.path.join(parent_dir, "midi_coll.store"),
+        help="path of the corpus store to write"
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,117 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import cli
+from constants import num_onsets, num_pitches
+from train import Markov, augment_keys, concat_sequences, get_modes, read_coll_tunes
+
+
+def log_likelihood(markov: Markov, values: np.ndarray, offsets: np.ndarray, alpha: float):
+    """
+    (total log-likelihood, number of notes, number of unseen transitions) of the sequences
+    values[offsets[k]:offsets[k+1]] under the markov, with add-alpha smoothing of its counts
+    """
+    lengths = np.diff(offsets)
+    starts = offsets[:-1][lengths > 0]
+    is_next = np.ones(values.size, dtype=bool)
+    is_next[starts] = False
+    nexts = np.flatnonzero(is_next)
+    lasts = values[nexts - 1]
+
+    init_count = np.asarray(markov.init_count, dtype=np.float64)
+    counts = markov.transition_count[lasts, values[nexts]]
+    totals = markov.transition_count.sum(axis=1)[lasts]
+    smoothing = alpha * markov.num_states
+    total = (np.log((init_count[values[starts]] + alpha) / (markov.num_Tunes + smoothing)).sum()
+        + np.log((counts + alpha) / (totals + smoothing)).sum())
+    return float(total), int(values.size), int(np.count_nonzero(counts == 0))
+
+def metrics(total: float, notes: int, unseen: int) -> dict:
+    return {
+        "log_likelihood": total,
+        "notes": notes,
+        "per_note": total / notes if notes else None,
+        "perplexity": math.exp(-total / notes) if notes else None,
+        "unseen_transitions": unseen,
+    }
+
+def evaluate_fold(train: dict, test: dict, alpha: float, augment: bool = False, register: tuple = None) -> dict:
+    """
+    train: name => (values, offsets) of the training tunes; test: the same for the held-out ones.
+    with augment, the pitch markov is trained on the key transpositions of the training tunes
+    """
+    if augment:
+        train = dict(train, pitch=augment_keys(*train["pitch"], register))
+    result = {}
+    for name, num_states in [("pitch", num_pitches), ("onset", num_onsets)]:
+        markov = Markov(num_states)
+        markov.add_transitions_batch(*train[name])
+        result[name] = log_likelihood(markov, *test[name], alpha)
+    return result
+
+
+def split_folds(num_tunes: int, folds: int, seed: int) -> np.ndarray:
+    """ the fold of every tune: a seeded shuffle dealt round-robin, so fold sizes differ by at most one """
+    if not 2 <= folds <= num_tunes:
+        raise ValueError(f"cannot split {num_tunes} tunes into {folds} folds")
+    fold_of = np.zeros(num_tunes, dtype=np.int64)
+    fold_of[np.random.default_rng(seed).permutation(num_tunes)] = np.arange(num_tunes) % folds
+    return fold_of
+
+def cross_validate(tunes: list, folds: int, alpha: float, seed: int = 0, workers: int = 1,
+    augment: bool = False, register: tuple = None) -> dict:
+    """ k-fold held-out log-likelihood and perplexity of the pitch and onset markovs over (name, onsets, pitches) tunes """
+    fold_of = split_folds(len(tunes), folds, seed)
+    jobs = []
+    for k in range(folds):
+        split = {}
+        for held_out in [False, True]:
+            chosen = [tune for tune, fold in zip(tunes, fold_of) if (fold == k) == held_out]
+            split[held_out] = {
+                "pitch": concat_sequences([pitches for _, _, pitches in chosen]),
+                "onset": concat_sequences([onsets for _, onsets, _ in chosen]),
+            }
+        jobs.append((split[False], split[True], alpha, augment, register))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, folds)) as pool:
+            results = list(pool.map(evaluate_fold, *zip(*jobs)))
+    else:
+        results = [evaluate_fold(*job) for job in jobs]
+
+    report = {"tunes": len(tunes), "folds": folds, "alpha": alpha, "seed": seed, "augment": augment,
+        "register": list(register) if register else None, "per_fold": []}
+    for name in ["pitch", "onset"]:
+        report[name] = metrics(*[sum(r[name][i] for r in results) for i in range(3)])
+    for k, result in enumerate(results):
+        fold = {"fold": k, "tunes": int(np.count_nonzero(fold_of == k))}
+        fold.update({name: metrics(*result[name]) for name in ["pitch", "onset"]})
+        report["per_fold"].append(fold)
+    return report
+
+
+def main(args):
+    tunes = list(read_coll_tunes(args.colldir, args.mood, get_modes(args.mode), args.timesig))
+    report = {"mood": args.mood, "mode": args.mode or "both", "timesig": args.timesig}
+    report.update(cross_validate(tunes, args.folds, args.alpha, args.seed, args.workers,
+        args.augment, args.register))
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as wf:
+            wf.write(text + "\n")
+        print(f"written {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the markovs by k-fold held-out log-likelihood")
+    cli.add_evaluate_arguments(parser)
+
+    args = parser.parse_args()
+    cli.check_evaluate_arguments(parser, args)
+    main(args)
@@ -0,0 +1,271 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import bisect
+import math
+import os
+from fractions import Fraction
+
+import coll_codec
+import instrument
+from constants import quarter_length_divisors, tick_quarter
+
+# music21 reduces offsets to fractions below this denominator
+denom_limit = 65535
+
+# tonic of a key signature, indexed by sharp count + 7
+major_tonics = ['C-', 'G-', 'D-', 'A-', 'E-', 'B-', 'F', 'C', 'G', 'D', 'A', 'E', 'B', 'F#', 'C#']
+minor_tonics = ['A-', 'E-', 'B-', 'F', 'C', 'G', 'D', 'A', 'E', 'B', 'F#', 'C#', 'G#', 'D#', 'A#']
+step_midi = {'C': 60, 'D': 62, 'E': 64, 'F': 65, 'G': 67, 'A': 69, 'B': 71}
+
+
+def name_to_midi(name: str) -> int:
+    """ midi number of a pitch name in octave 4, e.g. 'E-' => 63 """
+    midi_num = step_midi[name[0]]
+    for accidental in name[1:]:
+        midi_num += 1 if accidental == '#' else -1
+    return midi_num
+
+
+def read_var_len(data: bytes, pos: int):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_track(data: bytes) -> list:
+    """ decode a MTrk chunk into (tick, kind, values) events """
+    events = []
+    pos = 0
+    tick = 0
+    status = 0
+    while pos < len(data):
+        delta, pos = read_var_len(data, pos)
+        tick += delta
+        byte = data[pos]
+        if byte & 0x80:
+            status = byte
+            pos += 1
+        # otherwise running status: the byte is already the first data byte
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_var_len(data, pos + 1)
+            meta = data[pos:pos + length]
+            pos += length
+            if meta_type == 0x58:
+                events.append((tick, 'timesig', (meta[0], 2 ** meta[1])))
+            elif meta_type == 0x59:
+                sharps = meta[0] - 256 if meta[0] > 12 else meta[0]
+                events.append((tick, 'keysig', (sharps, meta[1])))
+            elif meta_type == 0x2F:
+                break
+        elif status in (0xF0, 0xF7):
+            length, pos = read_var_len(data, pos)
+            pos += length
+        else:
+            kind = status & 0xF0
+            channel = status & 0x0F
+            if kind in (0xC0, 0xD0):
+                pos += 1
+                continue
+            p1, p2 = data[pos], data[pos + 1]
+            pos += 2
+            if kind == 0x90 and p2 > 0:
+                events.append((tick, 'on', (channel, p1, p2)))
+            elif kind == 0x80 or kind == 0x90:
+                events.append((tick, 'off', (channel, p1)))
+    return events
+
+
+def read_midi(midi_file: str):
+    """ returns ticks per quarter and the decoded events of each track """
+    with open(midi_file, "rb") as rf:
+        data = rf.read()
+    if data[:4] != b'MThd':
+        raise ValueError(f"{midi_file} is not a standard midi file")
+    header_len = int.from_bytes(data[4:8], 'big')
+    division = int.from_bytes(data[12:14], 'big')
+    if division & 0x8000:
+        raise ValueError(f"{midi_file}: SMPTE time division is not supported")
+    tracks = []
+    pos = 8 + header_len
+    while pos + 8 <= len(data):
+        chunk_type = data[pos:pos + 4]
+        chunk_len = int.from_bytes(data[pos + 4:pos + 8], 'big')
+        pos += 8
+        if chunk_type == b'MTrk':
+            tracks.append(read_track(data[pos:pos + chunk_len]))
+        pos += chunk_len
+    return division, tracks
+
+
+def pair_notes(events: list) -> list:
+    """ (on tick, off tick, pitch, vel) per note; each note-on ends at the next matching note-off """
+    notes = []
+    awaiting_off = {}
+    # walk backwards like music21 so that unmatched note-ons are dropped the same way
+    for tick, kind, values in reversed(events):
+        if kind == 'off':
+            awaiting_off[values] = tick
+        elif kind == 'on':
+            channel, pitch, vel = values
+            if (channel, pitch) in awaiting_off:
+                notes.append((tick, awaiting_off[(channel, pitch)], pitch, vel))
+    notes.reverse()
+    return notes
+
+
+def op_frac(value) -> Fraction:
+    return Fraction(value).limit_denominator(denom_limit)
+
+
+def best_match(target: float, zero_allowed: bool = True, gap_to_fill: Fraction = Fraction(0)) -> Fraction:
+    """ nearest grid point over all divisors, with music21's tie-breaking """
+    found = []
+    for div in quarter_length_divisors:
+        tick = 1 / div
+        mult = math.floor(target / tick)
+        low = tick * mult
+        if target <= low + tick / 2.0:
+            mult_match, error = mult, round(target - low, 7)
+        else:
+            mult_match, error = mult + 1, round(tick * (mult + 1) - target, 7)
+        if not zero_allowed and mult_match == 0:
+            mult_match, error = 1, abs(round(target - tick, 7))
+        match = Fraction(mult_match, div)
+        if gap_to_fill % Fraction(1, div) == 0:
+            remaining_gap = 0
+        else:
+            remaining_gap = max(gap_to_fill - match, 0)
+        found.append((remaining_gap, error, tick, match))
+    return min(found)[3]
+
+
+def quantize_tick(tick: int, ticks_per_quarter: int) -> Fraction:
+    return best_match(float(op_frac(Fraction(tick, ticks_per_quarter))))
+
+
+def quantize_notes(notes: list, ticks_per_quarter: int) -> list:
+    """ (offset, dur, pitch, vel) in quarter lengths, snapped to the quantization grid """
+    notes = sorted(notes, key=lambda n: n[0])
+    offsets = [quantize_tick(on, ticks_per_quarter) for on, _, _, _ in notes]
+    quantized = []
+    for i, (on, off, pitch, vel) in enumerate(notes):
+        offset = offsets[i]
+        ql = float(op_frac(Fraction(off - on, ticks_per_quarter)))
+        # the duration should fill the gap up to the next (non-coincident) note when possible
+        next_offset = next((o for o in offsets[i + 1:] if o > offset), None)
+        if next_offset is not None:
+            dur = best_match(ql, zero_allowed=False, gap_to_fill=next_offset - offset)
+        else:
+            dur = best_match(ql, zero_allowed=False)
+        quantized.append((offset, dur, pitch, vel))
+    return quantized
+
+
+def measure_starts(timesigs: list, end: Fraction) -> list:
+    """ offset of every barline until end """
+    if not timesigs or timesigs[0][0] != 0:
+        timesigs = [(Fraction(0), 4, 4)] + timesigs
+    starts = []
+    start = Fraction(0)
+    while start <= end:
+        # the time signature in effect at the measure start sets its length
+        num, den = [(n, d) for o, n, d in timesigs if o <= start][-1]
+        starts.append(start)
+        start += Fraction(num * 4, den)
+    return starts
+
+
+def read_score(midi_file: str):
+    """ time signatures, key signatures and quantized notes of a midi file, sorted by offset """
+    ticks_per_quarter, tracks = read_midi(midi_file)
+
+    timesigs = []
+    keysigs = []
+    notes = []
+    for events in tracks:
+        for tick, kind, values in events:
+            if kind == 'timesig':
+                timesigs.append((quantize_tick(tick, ticks_per_quarter), *values))
+            elif kind == 'keysig':
+                keysigs.append((quantize_tick(tick, ticks_per_quarter), *values))
+        notes += quantize_notes(pair_notes(events), ticks_per_quarter)
+    timesigs.sort(key=lambda t: t[0])
+    keysigs.sort(key=lambda k: k[0])
+    notes.sort(key=lambda n: n[0])
+    return timesigs, keysigs, notes
+
+
+def parse_file(midi_file: str, coll_dir: str = "midi_coll", normalize_key: bool = True):
+    # extract file name without path or extension
+    dirname = os.path.dirname(midi_file)
+    mood_dir_name = os.path.basename(dirname)
+    name = os.path.splitext(os.path.basename(midi_file))[0]
+    coll_fp = os.path.join(coll_dir, mood_dir_name, name) + ".txt"
+
+    with instrument.timer("parse.read", file=midi_file):
+        timesigs, keysigs, notes = read_score(midi_file)
+
+    for _, num_beats, beat_length in timesigs:
+        print(f'Time signature: {num_beats}/{beat_length}')
+        if beat_length != 4:
+            print(f'This program only supports beat length of 4 for now. Discarded.')
+            instrument.count("parse.skipped_beat_length")
+            return None
+
+    # normalize key to 3flats (Cm or EbM)
+    transpose = 0
+    if normalize_key and keysigs:
+        with instrument.timer("parse.normalize", file=midi_file):
+            _, sharps, minor = keysigs[0]
+            tonic = (minor_tonics if minor else major_tonics)[sharps + 7]
+            transpose = name_to_midi('E-') - name_to_midi(tonic)
+
+    end = max((offset + dur for offset, dur, _, _ in notes), default=Fraction(0))
+    starts = measure_starts(timesigs, end)
+
+    with instrument.timer("parse.write", file=midi_file):
+        onsets, pitches, vels = [], [], []
+        for offset, dur, pitch, vel in notes:
+            # the measure the note starts in, and the later barlines it is tied over
+            # (the last tied piece is a tie-stop on beat 1 and is discarded, like the music21 path)
+            first = bisect.bisect_right(starts, offset)
+            last = bisect.bisect_left(starts, offset + dur)
+            pieces = [offset] + starts[first:last][:-1]
+            for piece in pieces:
+                measure_start = starts[bisect.bisect_right(starts, piece) - 1]
+                # onset in the current measure
+                onsets.append(int((piece - measure_start) * tick_quarter))
+                pitches.append(pitch + transpose)
+                vels.append(vel)
+        # NOTE: dur not of interest for now
+        coll_codec.write(coll_fp, range(len(pitches)), onsets, pitches, [100] * len(pitches), vels)
+    instrument.count("parse.notes", len(pitches))
+    return coll_fp
+
+
+def main(args):
+    parse_file(args.midifile, coll_dir=args.colldir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse a midi file into a Max coll without music21")
+    parser.add_argument(
+        "midifile",
+        type=str,
+        help="path to a midi file"
+    )
+    parser.add_argument(
+        "--colldir",
+        type=str,
+        default="midi_coll",
+        help="root directory of the coll files"
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,377 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import hashlib
+import os
+import numpy as np
+
+import coll_codec
+from constants import num_onsets, num_pitches
+from markov_model import MarkovModel, SparseMarkovModel
+from phrase_cache import PhraseCache
+
+parent_dir = os.path.dirname(os.path.abspath(__file__))
+
+default_dur = 100
+default_vel = 100
+# pitch classes of the tonic of the key every coll is normalized to: E-flat major, C minor
+tonic_pitch_classes = {"major": [3], "minor": [0], "both": [0, 3]}
+
+
+def load_markov(fname: str):
+    """ initial and transition probabilities from a Max markov text file (see train.Markov) """
+    num_states = 0
+    init = None
+    trans = None
+    with open(fname) as rf:
+        for line in rf:
+            props = line.split()
+            if not props:
+                continue
+            if props[0] == "states":
+                num_states = int(props[1])
+                init = np.zeros(num_states)
+                trans = np.zeros((num_states, num_states))
+            elif props[0] == "initial_prob":
+                start = int(props[1])
+                values = np.array(props[2:], dtype=float)
+                init[start:start + values.size] = values
+            elif props[0] == "transitions":
+                trans[int(props[1])] = np.array(props[2:], dtype=float)
+    return init, trans
+
+
+class MarkovSampler:
+    """
+    inverse-CDF sampler over precomputed cumulative tables.
+
+    all rows are laid out in one increasing array (row i's cdf shifted by i), so drawing the
+    next state of a whole batch is a single searchsorted of (last state + uniform draw).
+    """
+
+    def __init__(self, init: np.ndarray, trans: np.ndarray):
+        self.num_states = init.size
+        # states without any transition restart from the initial distribution
+        trans = trans.copy()
+        empty = trans.sum(axis=1) == 0
+        trans[empty] = init
+        self.init_cdf = self.cdf(init)
+        self.row_cdf = (np.apply_along_axis(self.cdf, 1, trans) + np.arange(self.num_states)[:, None]).ravel()
+
+    @staticmethod
+    def cdf(probs: np.ndarray) -> np.ndarray:
+        cdf = np.cumsum(probs)
+        return cdf / cdf[-1]
+
+    def sample(self, num_melodies: int, length: int, rng: np.random.Generator) -> np.ndarray:
+        """ (num_melodies, length) array of states """
+        states = np.zeros((num_melodies, length), dtype=np.int64)
+        if length == 0:
+            return states
+        states[:, 0] = np.searchsorted(self.init_cdf, rng.random(num_melodies), side="right")
+        for step in range(1, length):
+            last = states[:, step - 1]
+            flat = np.searchsorted(self.row_cdf, last + rng.random(num_melodies), side="right")
+            states[:, step] = flat - last * self.num_states
+        # guard against rounding at the very top of a row
+        return np.minimum(states, self.num_states - 1)
+
+
+class SparseSampler:
+    """
+    inverse-CDF sampler over the CSR rows of a SparseMarkovModel: MarkovSampler's layout (row i's
+    cdf shifted by i) over the observed transitions only, so a batch step is one searchsorted
+    over the nonzeros and nothing of size num_states^2 is ever built
+    """
+
+    def __init__(self, model: SparseMarkovModel):
+        self.num_states = model.num_states
+        self.indptr = np.asarray(model.indptr)
+        self.indices = np.asarray(model.indices, dtype=np.int64)
+        row_lengths = np.diff(self.indptr)
+        rows = np.repeat(np.arange(self.num_states), row_lengths)
+        # within-row cumulative probabilities, normalized so that every nonempty row ends on exactly 1
+        cdf = np.cumsum(model.probs)
+        before = np.concatenate([[0.0], cdf])[self.indptr[:-1]]
+        totals = np.concatenate([[0.0], cdf])[self.indptr[1:]] - before
+        self.row_cdf = (cdf - before[rows]) / np.where(totals > 0, totals, 1)[rows] + rows
+        self.empty = row_lengths == 0
+        # states without any transition restart from the initial distribution
+        self.init_cdf = MarkovSampler.cdf(np.asarray(model.init))
+
+    def sample(self, num_melodies: int, length: int, rng: np.random.Generator) -> np.ndarray:
+        """ (num_melodies, length) array of states """
+        states = np.zeros((num_melodies, length), dtype=np.int64)
+        if length == 0:
+            return states
+        states[:, 0] = np.searchsorted(self.init_cdf, rng.random(num_melodies), side="right")
+        states[:, 0] = np.minimum(states[:, 0], self.num_states - 1)
+        for step in range(1, length):
+            last = states[:, step - 1]
+            u = rng.random(num_melodies)
+            # the first entry of the row above last + u, kept within the row against rounding at its top
+            flat = np.minimum(np.searchsorted(self.row_cdf, last + u, side="right"), self.indptr[last + 1] - 1)
+            restart = self.empty[last]
+            states[~restart, step] = self.indices[flat[~restart]]
+            states[restart, step] = np.minimum(
+                np.searchsorted(self.init_cdf, u[restart], side="right"), self.num_states - 1)
+        return states
+
+
+def markov_path(model_dir: str, name: str) -> str:
+    """ <name>_markov.model if there is one, else the <name>_markov.txt export """
+    model_fp = os.path.join(model_dir, f"{name}_markov.model")
+    if os.path.exists(model_fp):
+        return model_fp
+    return os.path.join(model_dir, f"{name}_markov.txt")
+
+
+def load_probs(model_dir: str, name: str):
+    """ init and transitions of <name>_markov.model, memory mapped, or else parsed from <name>_markov.txt """
+    markov_fp = markov_path(model_dir, name)
+    if markov_fp.endswith(".model"):
+        model = MarkovModel.load(markov_fp)
+        return model.init, model.trans
+    return load_markov(markov_fp)
+
+
+def ngram_path(model_dir: str, name: str, order: int) -> str:
+    """ <name>_markov_order<N>.npz, written by train --order N """
+    return os.path.join(model_dir, f"{name}_markov_order{order}.npz")
+
+
+def model_files(model_dir: str, constraints: dict = None) -> list:
+    """ the markov files generate() samples from with these constraints """
+    constraints = constraints or {}
+    if constraints.get("joint"):
+        return [os.path.join(model_dir, "joint_markov.model")]
+    if constraints.get("order", 1) > 1:
+        return [ngram_path(model_dir, name, constraints["order"]) for name in ["pitch", "onset"]]
+    return [markov_path(model_dir, name) for name in ["pitch", "onset"]]
+
+
+def model_hash(markov_fps: list) -> str:
+    """ sha1 of the markov files """
+    h = hashlib.sha1()
+    for markov_fp in markov_fps:
+        with open(markov_fp, "rb") as rf:
+            h.update(rf.read())
+    return h.hexdigest()
+
+
+def load_samplers(model_dir: str):
+    pitch_sampler = MarkovSampler(*load_probs(model_dir, "pitch"))
+    onset_sampler = MarkovSampler(*load_probs(model_dir, "onset"))
+    return pitch_sampler, onset_sampler
+
+
+def model_mode(model_dir: str) -> str:
+    """ major, minor or both: the mode the pitch markov was trained on (both when it is not recorded) """
+    markov_fp = markov_path(model_dir, "pitch")
+    if markov_fp.endswith(".model"):
+        return MarkovModel.load(markov_fp).meta.get("mode") or "both"
+    return "both"
+
+
+def constraint_masks(model_dir: str, length: int, constraints: dict):
+    """ per-step allowed pitch and onset states (see constrained.step_masks) for the constraints """
+    from constrained import step_masks
+
+    allowed = None
+    if constraints.get("register"):
+        low, high = constraints["register"]
+        allowed = (np.arange(num_pitches) >= low) & (np.arange(num_pitches) <= high)
+    end = None
+    if constraints.get("end_pitch") is not None:
+        end = np.arange(num_pitches) == constraints["end_pitch"]
+    elif constraints.get("end_on_tonic"):
+        end = np.isin(np.arange(num_pitches) % 12, tonic_pitch_classes[model_mode(model_dir)])
+    pitch_masks = step_masks(num_pitches, length, allowed, end)
+    onset_end = np.arange(num_onsets) == 0 if constraints.get("end_on_downbeat") else None
+    onset_masks = step_masks(num_onsets, length, end=onset_end)
+    return pitch_masks, onset_masks
+
+
+def generate(model_dir: str, num_melodies: int, length: int, seed: int = None, constraints: dict = None):
+    """
+    (pitches, onsets) arrays of shape (num_melodies, length). with constraints (register, end_pitch,
+    end_on_tonic, end_on_downbeat), each phrase is drawn exactly from the markovs conditioned on them;
+    with viterbi, the single most likely phrase (shape (1, length)) is returned instead.
+    with joint, pitches and onsets are drawn together from joint_markov.model, and with order N > 1
+    each note follows the N previous ones (<pitch|onset>_markov_order<N>.npz); neither takes other constraints
+    """
+    constraints = dict(constraints or {})
+    order = constraints.pop("order", 1)
+    if order > 1:
+        if any(constraints.values()):
+            raise ValueError("the order-N markovs are only sampled without constraints")
+        from ngram_markov import NgramMarkov
+        rng = np.random.default_rng(seed)
+        pitches = NgramMarkov.load(ngram_path(model_dir, "pitch", order)).sample(num_melodies, length, rng)
+        onsets = NgramMarkov.load(ngram_path(model_dir, "onset", order)).sample(num_melodies, length, rng)
+        return pitches, onsets
+    if constraints.pop("joint", False):
+        if any(constraints.values()):
+            raise ValueError("the joint markov is only sampled without constraints")
+        sampler = SparseSampler(SparseMarkovModel.load(os.path.join(model_dir, "joint_markov.model")))
+        states = sampler.sample(num_melodies, length, np.random.default_rng(seed))
+        return np.divmod(states, num_onsets)
+
+    if not any(constraints.values()):
+        pitch_sampler, onset_sampler = load_samplers(model_dir)
+        rng = np.random.default_rng(seed)
+        pitches = pitch_sampler.sample(num_melodies, length, rng)
+        onsets = onset_sampler.sample(num_melodies, length, rng)
+        return pitches, onsets
+
+    from constrained import ConstrainedSampler
+    pitch_sampler = ConstrainedSampler(*load_probs(model_dir, "pitch"))
+    onset_sampler = ConstrainedSampler(*load_probs(model_dir, "onset"))
+    pitch_masks, onset_masks = constraint_masks(model_dir, length, constraints)
+    if constraints.get("viterbi"):
+        return pitch_sampler.viterbi(pitch_masks)[None, :], onset_sampler.viterbi(onset_masks)[None, :]
+    rng = np.random.default_rng(seed)
+    pitches = pitch_sampler.sample(pitch_masks, num_melodies, rng)
+    onsets = onset_sampler.sample(onset_masks, num_melodies, rng)
+    return pitches, onsets
+
+
+def generate_cached(cache, model_dir: str, num_melodies: int, length: int, seed: int = None,
+    constraints: dict = None):
+    """ generate(), through a phrase_cache.PhraseCache keyed by the model files and parameters (only when seeded) """
+    viterbi = bool(constraints and constraints.get("viterbi"))
+    if cache is None or (seed is None and not viterbi):
+        return generate(model_dir, num_melodies, length, seed, constraints)
+    if viterbi:
+        num_melodies = 1
+    key = cache.key("generate", model_hash(model_files(model_dir, constraints)), num_melodies, length, seed, sorted((constraints or {}).items()))
+    melodies = cache.get(key)
+    if melodies is None:
+        pitches, onsets = generate(model_dir, num_melodies, length, seed, constraints)
+        melodies = {"pitches": pitches.tolist(), "onsets": onsets.tolist()}
+        cache.put(key, melodies)
+    return (np.array(melodies["pitches"], dtype=np.int64).reshape(num_melodies, length),
+        np.array(melodies["onsets"], dtype=np.int64).reshape(num_melodies, length))
+
+
+def write_coll(coll_fp: str, pitches: np.ndarray, onsets: np.ndarray, vel: int = default_vel):
+    num_notes = len(pitches)
+    coll_codec.write(coll_fp, range(num_notes), onsets, pitches, [default_dur] * num_notes, [vel] * num_notes)
+
+
+def main(args):
+    cache = PhraseCache(disk_dir=args.cache) if args.cache else None
+    constraints = {
+        "register": tuple(args.register) if args.register else None,
+        "end_pitch": args.end_pitch,
+        "end_on_tonic": args.end_on_tonic,
+        "end_on_downbeat": args.end_on_downbeat,
+        "viterbi": args.viterbi,
+    }
+    if args.joint:
+        constraints["joint"] = True
+    if args.order > 1:
+        constraints["order"] = args.order
+    pitches, onsets = generate_cached(cache, args.model, args.num, args.length, args.seed, constraints)
+    os.makedirs(args.outdir, exist_ok=True)
+    for i in range(len(pitches)):
+        write_coll(os.path.join(args.outdir, f"melody_{i}.txt"), pitches[i].tolist(), onsets[i].tolist())
+    print(f"written {len(pitches)} melodies to {args.outdir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sample melodies from trained pitch and onset markovs")
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=parent_dir,
+        help="directory with pitch_markov.model and onset_markov.model, or the .txt exports (e.g. a model bank entry)"
+    )
+    parser.add_argument(
+        "--num",
+        type=int,
+        default=1,
+        help="number of melodies to generate"
+    )
+    parser.add_argument(
+        "--length",
+        type=int,
+        default=32,
+        help="number of notes per melody"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="random seed, for reproducible batches"
+    )
+    parser.add_argument(
+        "--outdir",
+        type=str,
+        default="generated",
+        help="directory to write the generated coll files to"
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="directory of a phrase cache: the same model files, --num, --length and --seed reuse the stored melodies"
+    )
+    parser.add_argument(
+        "--register",
+        type=int,
+        nargs=2,
+        metavar=("LOW", "HIGH"),
+        help="keep every pitch within LOW..HIGH"
+    )
+    parser.add_argument(
+        "--end-pitch",
+        type=int,
+        help="end every melody on this pitch"
+    )
+    parser.add_argument(
+        "--end-on-tonic",
+        action="store_true",
+        help="end every melody on the tonic (E-flat in major, C in minor, either for a model of both modes)"
+    )
+    parser.add_argument(
+        "--end-on-downbeat",
+        action="store_true",
+        help="end every melody on the first beat of a measure"
+    )
+    parser.add_argument(
+        "--viterbi",
+        action="store_true",
+        help="write the single most likely melody under the constraints instead of sampling --num melodies"
+    )
+    parser.add_argument(
+        "--joint",
+        action="store_true",
+        help="sample pitches and onsets together from joint_markov.model (train --joint); no constraints"
+    )
+
+    parser.add_argument(
+        "--order",
+        type=int,
+        default=1,
+        help="sample from the order-N markovs of train --order N (<pitch|onset>_markov_order<N>.npz); no constraints"
+    )
+
+    args = parser.parse_args()
+    if args.register and not 0 <= args.register[0] <= args.register[1] < num_pitches:
+        parser.error(f"--register needs 0 <= LOW <= HIGH <= {num_pitches - 1}")
+    if args.end_pitch is not None and not 0 <= args.end_pitch < num_pitches:
+        parser.error(f"--end-pitch must be within 0..{num_pitches - 1}")
+    if args.viterbi and args.num != 1:
+        parser.error("--viterbi writes the single most likely melody: drop --num")
+    if args.order < 1:
+        parser.error("--order must be at least 1")
+    if args.order > 1 and (args.joint or args.register or args.end_pitch is not None or args.end_on_tonic or
+        args.end_on_downbeat or args.viterbi):
+        parser.error("--order above 1 cannot be combined with --joint, the constraints or --viterbi")
+    if args.joint and (args.register or args.end_pitch is not None or args.end_on_tonic or
+        args.end_on_downbeat or args.viterbi):
+        parser.error("--joint cannot be combined with the constraints or --viterbi")
+    from constrained import InfeasibleConstraints
+    try:
+        main(args)
+    except InfeasibleConstraints as e:
+        parser.error(f"{e}; loosen --register, --end-pitch or the end conditions")
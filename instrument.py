@@ -0,0 +1,113 @@
+# opt-in timers and counters, written as JSON lines.
+#
+# enable with GHIBLI_INSTRUMENT=<path, or - for stderr> (inherited by worker processes)
+# or cli.py --instrument <path>. disabled, timer() hands out a shared no-op context and
+# count() returns at once; both are only called once per stage, never per note.
+#
+# every line has the wall clock time, the pid and the event:
+#     {"event": "timer", "name": "tidy", "seconds": ..., <fields>}
+#     {"event": "count", "name": "tidy.ties", "n": ...}
+#     {"event": "summary", "timers": {name: {"calls", "seconds"}}, "counters": {name: total}}
+# the summary is written at exit of the main process; pool workers (which re-import this
+# module under spawn) only write their events
+
+import atexit
+import json
+import os
+import sys
+import time
+
+env_var = "GHIBLI_INSTRUMENT"
+
+enabled = False
+_sink = None
+# name => [calls, seconds] / total, for the summary of this process
+_timers = {}
+_counters = {}
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+
+class Timer:
+    __slots__ = ("name", "fields", "start", "seconds")
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+        self.seconds = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        total = _timers.setdefault(self.name, [0, 0.0])
+        total[0] += 1
+        total[1] += self.seconds
+        emit("timer", name=self.name, seconds=self.seconds, **self.fields)
+        return False
+
+
+def timer(name: str, **fields):
+    """ with timer("parse", file=...): times the block """
+    if not enabled:
+        return _null_timer
+    return Timer(name, fields)
+
+def count(name: str, n: int = 1):
+    if not enabled:
+        return
+    _counters[name] = _counters.get(name, 0) + n
+    emit("count", name=name, n=n)
+
+def emit(event: str, **fields):
+    if not enabled:
+        return
+    record = {"time": time.time(), "pid": os.getpid(), "event": event}
+    record.update(fields)
+    # one write per line: lines of processes appending to the same file do not interleave
+    _sink.write(json.dumps(record) + "\n")
+    _sink.flush()
+
+
+def summary():
+    emit("summary",
+        timers={name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in _timers.items()},
+        counters=dict(_counters))
+
+def enable(path: str):
+    global enabled, _sink
+    if enabled:
+        return
+    _sink = sys.stderr if path == "-" else open(path, "a")
+    enabled = True
+    atexit.register(disable)
+
+def disable():
+    global enabled, _sink
+    if not enabled:
+        return
+    import multiprocessing
+    if multiprocessing.current_process().name == "MainProcess":
+        summary()
+    if _sink is not sys.stderr:
+        _sink.close()
+    enabled = False
+    _sink = None
+    _timers.clear()
+    _counters.clear()
+
+
+if os.environ.get(env_var):
+    enable(os.environ[env_var])
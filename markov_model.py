@@ -0,0 +1,126 @@
+import numpy as np
+
+from corpus_store import map_store, write_store
+
+# same layout as the corpus store: magic, header length, json header (the metadata), aligned arrays
+magic = b"GHIBMARK"
+format_version = 1
+
+
+class MarkovModel:
+    """
+    normalized first-order markov: init[s] is the probability of starting on state s,
+    trans[s] the distribution of the state after s (all zero for states never left).
+
+    meta holds what the model was trained on: kind (pitch / onset), mood, mode, timesig,
+    num_tunes and sources (coll file name => sha1 of its content).
+    """
+
+    def __init__(self, init: np.ndarray, trans: np.ndarray, meta: dict = None):
+        self.init = init
+        self.trans = trans
+        self.meta = dict(meta or {})
+
+    @property
+    def num_states(self) -> int:
+        return self.init.size
+
+    @classmethod
+    def from_counts(cls, init_count, transition_count: np.ndarray, num_tunes: int, **meta) -> "MarkovModel":
+        if num_tunes == 0:
+            raise ValueError("cannot normalize a markov trained on no tunes")
+        init = np.asarray(init_count, dtype=np.float64) / num_tunes
+        counts = np.asarray(transition_count, dtype=np.float64)
+        totals = counts.sum(axis=1, keepdims=True)
+        trans = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+        meta["num_tunes"] = int(num_tunes)
+        return cls(init, trans, meta)
+
+    def write(self, to_fname: str):
+        header = dict(self.meta, format=format_version, num_states=self.num_states)
+        write_store(to_fname, {"init": self.init, "trans": self.trans}, header, magic)
+
+    @classmethod
+    def load(cls, fname: str) -> "MarkovModel":
+        """ memory maps the probabilities; nothing is parsed but the json header """
+        header, arrays = map_store(fname, magic)
+        if header.get("format") != format_version:
+            raise ValueError(f"{fname}: unsupported markov model format {header.get('format')}")
+        return cls(arrays["init"], arrays["trans"], header)
+
+    def max_text(self) -> str:
+        """ the Max markov object messages: reset, states, build, initial_prob and transitions """
+        # the initial probabilities of all states but the last, as the Max patch has always read them
+        lines = [f"reset\nstates {self.num_states}\nbuild",
+            " ".join(["initial_prob 0"] + list(map(repr, self.init[:-1].tolist())))]
+        rows = np.flatnonzero(self.trans.any(axis=1))
+        # repr of a float is the shortest string that reads back to it, as the per-value writes were
+        for i, row in zip(rows.tolist(), self.trans[rows].tolist()):
+            lines.append(f"transitions {i} " + " ".join(map(repr, row)))
+        return "\n".join(lines)
+
+    def write_text(self, to_fname: str):
+        with open(to_fname, "w") as pf:
+            pf.write(self.max_text())
+
+
+sparse_magic = b"GHIBSPMK"
+
+
+class SparseMarkovModel:
+    """
+    normalized first-order markov over a large, sparsely observed state space (the joint
+    pitch-onset states): only observed transitions are stored, CSR-style, i.e. the states
+    after s are indices[indptr[s]:indptr[s+1]] with probabilities probs[indptr[s]:indptr[s+1]].
+    init is dense; rows of states never left are empty.
+    """
+
+    def __init__(self, init: np.ndarray, indptr: np.ndarray, indices: np.ndarray, probs: np.ndarray,
+        meta: dict = None):
+        self.init = init
+        self.indptr = indptr
+        self.indices = indices
+        self.probs = probs
+        self.meta = dict(meta or {})
+
+    @property
+    def num_states(self) -> int:
+        return self.init.size
+
+    @property
+    def nnz(self) -> int:
+        return self.indices.size
+
+    @classmethod
+    def from_counts(cls, init_count, pair_keys: np.ndarray, pair_counts: np.ndarray, num_tunes: int,
+        **meta) -> "SparseMarkovModel":
+        """ from sorted pair keys (state * num_states + next state) and their counts, as NgramMarkov keeps them """
+        if num_tunes == 0:
+            raise ValueError("cannot normalize a markov trained on no tunes")
+        init = np.asarray(init_count, dtype=np.float64) / num_tunes
+        num_states = init.size
+        pair_keys = np.asarray(pair_keys, dtype=np.int64)
+        counts = np.asarray(pair_counts, dtype=np.float64)
+        rows = pair_keys // num_states
+        # each count over its row's total, without ever laying out the dense matrix
+        totals = np.bincount(rows, weights=counts, minlength=num_states)
+        indptr = np.searchsorted(rows, np.arange(num_states + 1)).astype(np.int64)
+        meta["num_tunes"] = int(num_tunes)
+        return cls(init, indptr, (pair_keys % num_states).astype(np.int32), counts / totals[rows], meta)
+
+    def row(self, state: int):
+        """ next states and their probabilities """
+        start, end = self.indptr[state], self.indptr[state + 1]
+        return self.indices[start:end], self.probs[start:end]
+
+    def write(self, to_fname: str):
+        header = dict(self.meta, format=format_version, num_states=self.num_states, nnz=self.nnz)
+        arrays = {"init": self.init, "indptr": self.indptr, "indices": self.indices, "probs": self.probs}
+        write_store(to_fname, arrays, header, sparse_magic)
+
+    @classmethod
+    def load(cls, fname: str) -> "SparseMarkovModel":
+        header, arrays = map_store(fname, sparse_magic)
+        if header.get("format") != format_version:
+            raise ValueError(f"{fname}: unsupported markov model format {header.get('format')}")
+        return cls(arrays["init"], arrays["indptr"], arrays["indices"], arrays["probs"], header)
@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class NgramMarkov:
+    """
+    order-N markov chain over num_states states, with back-off to lower orders.
+
+    only observed contexts are stored: for each context length k (1..order), the contexts
+    are packed into int64 keys (base num_states) and kept sorted, with CSR-style next-state
+    counts, i.e. the next states of keys[k][c] are next_states[k][indptr[k][c]:indptr[k][c+1]].
+    """
+
+    def __init__(self, num_states: int, order: int):
+        if order < 1:
+            raise ValueError("order must be at least 1")
+        if num_states ** (order + 1) >= 2 ** 63:
+            raise ValueError(f"order {order} contexts of {num_states} states do not fit in int64 keys")
+        self.num_states = num_states
+        self.order = order
+        # count of each state being the initial state
+        self.init_count = np.zeros(num_states, dtype=np.int64)
+        self.num_Tunes = 0
+        # per context length: sorted (context key * num_states + next state) and their counts
+        self.pair_keys = {k: np.zeros(0, dtype=np.int64) for k in range(1, order + 1)}
+        self.pair_counts = {k: np.zeros(0, dtype=np.int64) for k in range(1, order + 1)}
+        self._index = None
+
+    def add_transitions(self, seq: list):
+        self.add_transitions_batch(seq, [0, len(seq)])
+
+    def add_transitions_batch(self, values: np.ndarray, offsets: np.ndarray):
+        values = np.asarray(values, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if values.size and (values.min() < 0 or values.max() >= self.num_states):
+            raise IndexError(f"state out of range for a markov of {self.num_states} states")
+        lengths = np.diff(offsets)
+        starts = offsets[:-1][lengths > 0]
+        self.init_count += np.bincount(values[starts], minlength=self.num_states)
+        self.num_Tunes += len(lengths)
+
+        # position of every value within its own sequence
+        seq_pos = np.arange(values.size) - np.repeat(offsets[:-1], lengths)
+        for k in range(1, self.order + 1):
+            # every value preceded by at least k values of the same sequence
+            nexts = np.flatnonzero(seq_pos >= k)
+            keys = np.zeros(nexts.size, dtype=np.int64)
+            for i in range(k, 0, -1):
+                keys = keys * self.num_states + values[nexts - i]
+            pairs = keys * self.num_states + values[nexts]
+            self._merge(k, *np.unique(pairs, return_counts=True))
+        self._index = None
+
+    def _merge(self, k: int, keys: np.ndarray, counts: np.ndarray):
+        all_keys = np.concatenate([self.pair_keys[k], keys])
+        all_counts = np.concatenate([self.pair_counts[k], counts])
+        merged, inverse = np.unique(all_keys, return_inverse=True)
+        merged_counts = np.bincount(inverse, weights=all_counts, minlength=merged.size).astype(np.int64)
+        keep = merged_counts > 0
+        self.pair_keys[k] = merged[keep]
+        self.pair_counts[k] = merged_counts[keep]
+
+    def index(self) -> dict:
+        """ k => (sorted context keys, indptr, next states, counts), and 0 => the order-0 state counts """
+        if self._index is None:
+            # every value either starts its sequence or follows a value: init plus the order-1 next states
+            pairs = self.pair_keys[1]
+            self._index = {0: self.init_count + np.bincount(pairs % self.num_states,
+                weights=self.pair_counts[1], minlength=self.num_states).astype(np.int64)}
+            for k in range(1, self.order + 1):
+                pairs = self.pair_keys[k]
+                contexts = pairs // self.num_states
+                keys, first = np.unique(contexts, return_index=True)
+                indptr = np.append(first, pairs.size).astype(np.int64)
+                self._index[k] = (keys, indptr, pairs % self.num_states, self.pair_counts[k])
+        return self._index
+
+    def context_key(self, context) -> int:
+        key = 0
+        for state in context:
+            key = key * self.num_states + int(state)
+        return key
+
+    def next_counts(self, context):
+        """ next states and counts after the longest observed suffix of the context """
+        index = self.index()
+        for k in range(min(self.order, len(context)), 0, -1):
+            keys, indptr, next_states, counts = index[k]
+            key = self.context_key(context[-k:])
+            c = np.searchsorted(keys, key)
+            if c < keys.size and keys[c] == key:
+                return next_states[indptr[c]:indptr[c + 1]], counts[indptr[c]:indptr[c + 1]]
+        # no context observed: back off to the order-0 frequencies of the states
+        state_count = index[0]
+        states = np.flatnonzero(state_count)
+        return states, state_count[states]
+
+    def sample_next(self, context, rng: np.random.Generator) -> int:
+        if len(context) == 0:
+            states = np.flatnonzero(self.init_count)
+            counts = self.init_count[states]
+        else:
+            states, counts = self.next_counts(context)
+        cdf = np.cumsum(counts)
+        return int(states[np.searchsorted(cdf, rng.random() * cdf[-1], side="right")])
+
+    def sample(self, num_melodies: int, length: int, rng: np.random.Generator) -> np.ndarray:
+        """ (num_melodies, length) array of states, each drawn after the (up to order) previous ones """
+        states = np.zeros((num_melodies, length), dtype=np.int64)
+        for m in range(num_melodies):
+            for step in range(length):
+                states[m, step] = self.sample_next(states[m, max(0, step - self.order):step], rng)
+        return states
+
+    def write_model(self, to_fname: str):
+        arrays = {
+            "num_states": np.array(self.num_states),
+            "order": np.array(self.order),
+            "init_count": self.init_count,
+            "num_Tunes": np.array(self.num_Tunes),
+        }
+        for k in range(1, self.order + 1):
+            arrays[f"pair_keys_{k}"] = self.pair_keys[k]
+            arrays[f"pair_counts_{k}"] = self.pair_counts[k]
+        with open(to_fname, "wb") as wf:
+            np.savez(wf, **arrays)
+        print("written ", to_fname)
+
+    @classmethod
+    def load(cls, fname: str) -> "NgramMarkov":
+        with np.load(fname) as data:
+            model = cls(int(data["num_states"]), int(data["order"]))
+            model.init_count = data["init_count"]
+            model.num_Tunes = int(data["num_Tunes"])
+            for k in range(1, model.order + 1):
+                model.pair_keys[k] = data[f"pair_keys_{k}"]
+                model.pair_counts[k] = data[f"pair_counts_{k}"]
+        return model
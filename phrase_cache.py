@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+from array import array
+from collections import OrderedDict
+
+import instrument
+
+
+class PhraseCache:
+    """
+    results of deterministic transformations and samplings, keyed by a hash of everything they
+    depend on (coll content or model files, parameters, random state).
+
+    the memory tier holds the capacity most recently used entries; with a disk_dir, every entry
+    is also written there as <key>.json, so that it outlives the process and evictions
+    """
+
+    def __init__(self, capacity: int = 256, disk_dir: str = None):
+        self.capacity = capacity
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def random_state(rng) -> bytes:
+        """ key part of the state of a random.Random (or the random module), far cheaper than its repr """
+        version, internal, gauss_next = rng.getstate()
+        return array("I", internal).tobytes() + repr((version, gauss_next)).encode()
+
+    @staticmethod
+    def key(*parts) -> str:
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else repr(part).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def get(self, key: str):
+        """ the cached value, or None """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            instrument.count("cache.hit")
+            return self.entries[key]
+        if self.disk_dir and os.path.exists(self.disk_path(key)):
+            with open(self.disk_path(key)) as rf:
+                value = json.load(rf)
+            self.disk_hits += 1
+            instrument.count("cache.disk_hit")
+            self.remember(key, value)
+            return value
+        self.misses += 1
+        instrument.count("cache.miss")
+        return None
+
+    def put(self, key: str, value):
+        """ value has to be json serializable (int arrays included) when there is a disk tier """
+        self.remember(key, value)
+        if self.disk_dir:
+            # written aside and renamed, so that concurrent readers never see half an entry
+            tmp_fp = f"{self.disk_path(key)}.{os.getpid()}.tmp"
+            with open(tmp_fp, "w") as wf:
+                json.dump(value, wf, default=array.tolist)
+            os.replace(tmp_fp, self.disk_path(key))
+
+    def remember(self, key: str, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+            "evictions": self.evictions, "entries": len(self.entries)}
@@ -0,0 +1,183 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import random
+import socketserver
+import struct
+
+from collection import Collection
+from phrase_cache import PhraseCache
+
+# same coll basename the repetition/sequence scripts tidy into
+rand_coll_basename = "rand_coll"
+
+
+def osc_string(s: str) -> bytes:
+    data = s.encode() + b"\0"
+    return data + b"\0" * (-len(data) % 4)
+
+def read_osc_string(data: bytes, pos: int):
+    end = data.index(b"\0", pos)
+    return data[pos:end].decode(), end + 1 + (-(end + 1) % 4)
+
+def encode_message(address: str, *args) -> bytes:
+    tags = ","
+    payload = b""
+    for arg in args:
+        if isinstance(arg, int):
+            tags += "i"
+            payload += struct.pack(">i", arg)
+        elif isinstance(arg, float):
+            tags += "f"
+            payload += struct.pack(">f", arg)
+        else:
+            tags += "s"
+            payload += osc_string(str(arg))
+    return osc_string(address) + osc_string(tags) + payload
+
+def decode_message(data: bytes):
+    """ (address, args) of an OSC message """
+    address, pos = read_osc_string(data, 0)
+    args = []
+    if pos >= len(data):
+        return address, args
+    tags, pos = read_osc_string(data, pos)
+    for tag in tags[1:]:
+        if tag == "i":
+            args.append(struct.unpack(">i", data[pos:pos + 4])[0])
+            pos += 4
+        elif tag == "f":
+            args.append(struct.unpack(">f", data[pos:pos + 4])[0])
+            pos += 4
+        elif tag == "s":
+            arg, pos = read_osc_string(data, pos)
+            args.append(arg)
+        else:
+            raise ValueError(f"unsupported OSC type tag {tag}")
+    return address, args
+
+
+class TransformServer(socketserver.UDPServer):
+    """
+    keeps collections in memory between requests, keyed by coll path:
+
+        /load path [basename]                       read a coll (default basename: the file's)
+        /repeat path start end timesig              like repetition.py
+        /sequence path start end endpitch timesig   like sequence.py
+        /tidy path start timesig                    like tidyup_coll.py
+        /flush path                                 write the coll, tidy_* and group_* files
+        /close path                                 drop the collection (without writing it)
+        /seed n                                     seed the random choices of /sequence
+        /stats                                      phrase cache hits disk_hits misses evictions entries
+
+    every request is answered with /done op path [groups...] or /error op message.
+    repeat and sequence results are memoized in the phrase cache (when given), keyed by the
+    coll's notes, the parameters and the random state, so re-triggered variations are not recomputed
+    """
+
+    def __init__(self, address, autoflush: bool = False, cache: PhraseCache = None):
+        super().__init__(address, TransformHandler)
+        self.collections = {}
+        self.autoflush = autoflush
+        self.rng = random.Random()
+        self.cache = cache
+
+    def get(self, path: str, basename: str = None) -> Collection:
+        # first use loads the coll like the matching script would
+        if path not in self.collections:
+            self.collections[path] = Collection.load(path, basename)
+        return self.collections[path]
+
+    def handle_message(self, address: str, args: list) -> list:
+        op = address.lstrip("/")
+        if op == "seed":
+            self.rng.seed(args[0])
+            return [op]
+        if op == "stats":
+            stats = self.cache.stats() if self.cache else {}
+            return [op] + [stats.get(name, 0) for name in ["hits", "disk_hits", "misses", "evictions", "entries"]]
+        path = args[0]
+        if op == "load":
+            self.collections[path] = Collection.load(path, args[1] if len(args) > 1 else None)
+            return [op, path]
+        if op == "close":
+            self.collections.pop(path, None)
+            return [op, path]
+        if op == "flush":
+            self.collections[path].save()
+            return [op, path]
+
+        if op == "repeat":
+            start_idx, end_idx, time_sig = args[1:4]
+            coll = self.get(path, rand_coll_basename)
+            coll.cached(self.cache, (op, start_idx, end_idx, time_sig),
+                lambda c: c.repeat(start_idx, end_idx).tidy(end_idx - 1, time_sig))
+        elif op == "sequence":
+            start_idx, end_idx, endpitch, time_sig = args[1:5]
+            coll = self.get(path, rand_coll_basename)
+            coll.cached(self.cache, (op, start_idx, end_idx, endpitch, time_sig),
+                lambda c: c.sequence(start_idx, end_idx, endpitch, self.rng).tidy(end_idx - 1, time_sig), self.rng)
+        elif op == "tidy":
+            start_idx, time_sig = args[1:3]
+            coll = self.get(path)
+            coll.tidy(start_idx, time_sig)
+        else:
+            raise ValueError(f"unknown operation {address}")
+        if self.autoflush:
+            coll.save()
+        return [op, path] + coll.groups
+
+
+class TransformHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        data, sock = self.request
+        address = "?"
+        try:
+            address, args = decode_message(data)
+            reply = encode_message("/done", *self.server.handle_message(address, args))
+        except Exception as e:
+            reply = encode_message("/error", address.lstrip("/"), str(e))
+        sock.sendto(reply, self.client_address)
+
+
+def main(args):
+    cache = PhraseCache(args.cache_size, args.cache_dir) if args.cache_size > 0 or args.cache_dir else None
+    with TransformServer((args.host, args.port), autoflush=args.autoflush, cache=cache) as server:
+        print(f"listening on udp {args.host}:{args.port}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve repeat/sequence/tidy on in-memory collections over UDP (OSC)")
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="address to listen on"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=7400,
+        help="UDP port to listen on"
+    )
+    parser.add_argument(
+        "--autoflush",
+        action="store_true",
+        help="write the files after every transformation instead of only on /flush"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=256,
+        help="number of repeat/sequence results kept in memory, least recently used first out (0: no cache)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="also keep every cached result in this directory, across restarts"
+    )
+
+    args = parser.parse_args()
+    main(args)
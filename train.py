@@ -1,18 +1,25 @@
 #!/usr/local/bin/python3.7
 
 import argparse
+import hashlib
 import json
 import os
-import numpy as np
 
-num_pitches = 108
-tick_quarter = 12
-num_onsets = tick_quarter * 4
+import cli
+import coll_codec
+import instrument
+from constants import num_joint_states, num_onsets, num_pitches
+
+# numpy (and markov_model) are imported in the functions that use them, so --help stays fast
 
 parent_dir = os.path.dirname(os.path.abspath(__file__))
 
+# the transpositions of the augmentation: every key, within half an octave of the tune
+key_shifts = list(range(-6, 6))
+
 class Markov:
     def __init__(self, num_states: int):
+        import numpy as np
         # [
         #     [1 0 2], state 0's count of transition to each state
         #     [2 3 1], state 1's count of transition to each state
@@ -38,46 +45,135 @@ class Markov:
                 # print(f"add one to [{last}][{num}] (last;cur)")
             last = num
         self.num_Tunes += 1
+
+    def add_transitions_batch(self, values: "np.ndarray", offsets: "np.ndarray"):
+        # same counts as add_transitions on each values[offsets[k]:offsets[k+1]], in one pass
+        with instrument.timer("train.count", states=self.num_states, values=len(values)):
+            self._add_transitions_batch(values, offsets)
+
+    def _add_transitions_batch(self, values: "np.ndarray", offsets: "np.ndarray"):
+        import numpy as np
+        values = np.asarray(values, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if values.size and (values.min() < 0 or values.max() >= self.num_states):
+            raise IndexError(f"state out of range for a markov of {self.num_states} states")
+        starts = offsets[:-1][offsets[1:] > offsets[:-1]]
+        # starting with
+        init = np.bincount(values[starts], minlength=self.num_states)
+        self.init_count = [count + int(add) for count, add in zip(self.init_count, init)]
+        # last -> num for every position that does not start a sequence
+        is_next = np.ones(values.size, dtype=bool)
+        is_next[starts] = False
+        nexts = np.flatnonzero(is_next)
+        pairs = values[nexts - 1] * self.num_states + values[nexts]
+        self.transition_count += np.bincount(pairs, minlength=self.num_states ** 2).reshape(
+            self.num_states, self.num_states)
+        self.num_Tunes += len(offsets) - 1
+
+    def add_counts(self, other: "Markov", sign: int = 1):
+        # add (or with sign=-1, subtract) the counts of another markov of the same size
+        self.transition_count += sign * other.transition_count
+        self.init_count = [count + sign * add for count, add in zip(self.init_count, other.init_count)]
+        self.num_Tunes += sign * other.num_Tunes
     
-    def write_transitions(self, to_fname: str):
+    def to_model(self, **meta) -> "MarkovModel":
+        """ the normalized probabilities, with the metadata of the training run """
+        from markov_model import MarkovModel
+        return MarkovModel.from_counts(self.init_count, self.transition_count, self.num_Tunes, **meta)
+
+    def write_transitions(self, to_fname: str, model: "MarkovModel" = None):
         # write to file under model directory
         to_fname = os.path.join(parent_dir, to_fname)
-        with open(to_fname, "w") as pf:
-            # reset, states, build
-            pf.write(f"reset\nstates {self.num_states}\nbuild")
-            # initial prob
-            pf.write("\ninitial_prob 0")
-            for count in self.init_count[:-1]:
-                prob = count / self.num_Tunes
-                pf.write(f" {prob}")
-            # transitions
-            for i, state in enumerate(self.transition_count):
-                # no transition for the state if all zero
-                if not state.any():
-                    continue
-                pf.write(f"\ntransitions {i}")
-                total = np.sum(state)
-                for count in state:
-                    prob = count / total
-                    pf.write(f" {prob}")
+        with instrument.timer("train.emit", states=self.num_states, file=to_fname):
+            # reset, states, build, initial prob and transitions, formatted from the normalized arrays
+            (model or self.to_model()).write_text(to_fname)
         print("written ", to_fname)
 
-def main(args):
-    mood = args.mood
+def write_markovs(out_dir: str, pitch_markov: Markov, onset_markov: Markov, **meta):
+    """ <pitch|onset>_markov.model for loading by memory map, and the Max text generated from it """
+    for name, markov in [("pitch", pitch_markov), ("onset", onset_markov)]:
+        model = markov.to_model(kind=name, **meta)
+        model.write(os.path.join(out_dir, f"{name}_markov.model"))
+        markov.write_transitions(os.path.join(out_dir, f"{name}_markov.txt"), model)
+
+def concat_sequences(seqs: list):
+    """ concatenated values and offsets (seq k is values[offsets[k]:offsets[k+1]]) """
+    import numpy as np
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(seq) for seq in seqs])
+    if not seqs:
+        return np.zeros(0, dtype=np.int64), offsets
+    return np.concatenate([np.asarray(seq, dtype=np.int64) for seq in seqs]), offsets
+
+def augment_keys(values: "np.ndarray", offsets: "np.ndarray", register: tuple = None, shifts: list = key_shifts,
+    unit: int = 1):
+    """
+    values and offsets of every tune followed by its copies transposed by each shift that keeps
+    all its pitches within the register (lowest, highest pitch; default the whole pitch range).
+    the pitch of a value is value // unit, e.g. unit num_onsets for joint pitch-onset states
+    """
+    import numpy as np
+    values = np.asarray(values, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    low, high = register or (0, num_pitches - 1)
+    shifts = np.array([0] + [shift for shift in shifts if shift != 0], dtype=np.int64)
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    tune_min = np.zeros(lengths.size, dtype=np.int64)
+    tune_max = np.zeros(lengths.size, dtype=np.int64)
+    if nonempty.any():
+        tune_min[nonempty] = np.minimum.reduceat(values, offsets[:-1][nonempty]) // unit
+        tune_max[nonempty] = np.maximum.reduceat(values, offsets[:-1][nonempty]) // unit
+    # (tune, shift): the original tune is always kept, its transpositions only when they fit
+    fits = (tune_min[:, None] + shifts >= low) & (tune_max[:, None] + shifts <= high) & nonempty[:, None]
+    fits[:, 0] = True
+    tune_idx, shift_idx = np.nonzero(fits)
+    new_lengths = lengths[tune_idx]
+    new_offsets = np.zeros(tune_idx.size + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(new_lengths)
+    # each copy gathers its tune's values and adds its shift
+    src = np.repeat(offsets[:-1][tune_idx] - new_offsets[:-1], new_lengths) + np.arange(new_offsets[-1])
+    return values[src] + np.repeat(shifts[shift_idx] * unit, new_lengths), new_offsets
+
+def joint_markov(pitch_batch: tuple, onset_batch: tuple, augment: bool = False, register: tuple = None):
+    """
+    markov of the joint pitch-onset states (pitch * num_onsets + onset) of the (not augmented) batches.
+    its 5184 states would make a dense transition matrix of over 200 MB, so the counts are kept
+    sparse, as for the higher orders
+    """
+    import numpy as np
+    from ngram_markov import NgramMarkov
+    (pitches, offsets), (onsets, onset_offsets) = pitch_batch, onset_batch
+    if not np.array_equal(offsets, onset_offsets):
+        raise ValueError("the pitch and onset sequences of the joint markov differ in length")
+    batch = (pitches * num_onsets + onsets, offsets)
+    if augment:
+        batch = augment_keys(*batch, register, unit=num_onsets)
+    markov = NgramMarkov(num_joint_states, 1)
+    markov.add_transitions_batch(*batch)
+    return markov
+
+def write_joint_markov(out_dir: str, markov, **meta):
+    """ joint_markov.model, the normalized sparse rows; there is no Max text export of the joint states """
+    from markov_model import SparseMarkovModel
+    model = SparseMarkovModel.from_counts(markov.init_count, markov.pair_keys[1], markov.pair_counts[1],
+        markov.num_Tunes, kind="joint", num_onsets=num_onsets, **meta)
+    to_fname = os.path.join(out_dir, "joint_markov.model")
+    with instrument.timer("train.emit", states=model.num_states, nnz=model.nnz, file=to_fname):
+        model.write(to_fname)
+    print("written ", to_fname)
+
+def get_modes(mode_arg: str) -> list:
     mode = ["+", "-"]
-    if args.mode == "major":
+    if mode_arg == "major":
         mode = ["+"]
-    elif args.mode == "minor":
+    elif mode_arg == "minor":
         mode = ["-"]
-    
-    timesig = args.timesig
-
-    coll_dir = os.path.join(parent_dir, "midi_coll")
-
-    # initialize pitch and onset markovs
-    pitch_markov = Markov(num_pitches)
-    onset_markov = Markov(num_onsets)
+    return mode
 
+def list_coll_files(coll_dir: str, mood: str, mode: list, timesig: int) -> list:
+    """ the mood's coll files with the wanted mode and timesig """
+    wanted = []
     # go through the midi directory
     files = os.listdir(os.path.join(coll_dir, mood))
     for f in files:
@@ -87,44 +183,283 @@ def main(args):
             fname = os.path.splitext(f)[0]
             fmode = fname[-2]
             ftime = int(fname[-1])
-            # look at tunes with the wanted mode and timesig
-            if fmode in mode and ftime == timesig:
-                print(f"{f}")
-                pitches = []
-                onsets = []
-                # add transitions for pitch and onset to the corresponding markov
-                with open(os.path.join(coll_dir, mood, f)) as rf:
-                    for line in rf:
-                        props = line.split()
-                        onset = int(props[1])
-                        pitch = int(props[2])
-                        onsets.append(onset)
-                        pitches.append(pitch)
-                # print(pitches)
-                # print(onsets)
-                pitch_markov.add_transitions(pitches)
-                onset_markov.add_transitions(onsets)
+            # look at tunes with the wanted mode and timesig (any timesig if None)
+            if fmode in mode and (timesig is None or ftime == timesig):
+                wanted.append(f)
+    return wanted
+
+def read_coll_file(coll_fp: str):
+    """ onset and pitch columns of a coll file, as int arrays """
+    notes = coll_codec.read_array(coll_fp)
+    return notes[:, 1], notes[:, 2]
+
+def read_coll_tunes(coll_dir: str, mood: str, mode: list, timesig: int):
+    """ yields (file name, onsets, pitches) of the mood's coll files with the wanted mode and timesig """
+    for f in list_coll_files(coll_dir, mood, mode, timesig):
+        onsets, pitches = read_coll_file(os.path.join(coll_dir, mood, f))
+        yield f, onsets, pitches
+
+def read_store_tunes(store_fp: str, mood: str, mode: list, timesig: int):
+    """ same as read_coll_tunes, as zero-copy slices of a corpus store """
+    from corpus_store import CorpusStore
+    store = CorpusStore(store_fp)
+    for i in store.select(mood, mode, timesig):
+        onsets, pitches, _ = store.tune(i)
+        yield store.names[i], onsets, pitches
+
+def file_hash(fp: str) -> str:
+    with open(fp, "rb") as rf:
+        return hashlib.sha1(rf.read()).hexdigest()
+
+def markovs_from(tunes: list):
+    """ pitch and onset markovs trained on a list of checkpoint tune entries """
+    pitch_markov = Markov(num_pitches)
+    onset_markov = Markov(num_onsets)
+    pitch_markov.add_transitions_batch(*concat_sequences([t["pitches"] for t in tunes]))
+    onset_markov.add_transitions_batch(*concat_sequences([t["onsets"] for t in tunes]))
+    return pitch_markov, onset_markov
+
+def load_checkpoint(checkpoint_fp: str):
+    """ pitch markov, onset markov and the contributing tunes (file name => entry) """
+    import numpy as np
+    pitch_markov = Markov(num_pitches)
+    onset_markov = Markov(num_onsets)
+    tunes = {}
+    if not os.path.exists(checkpoint_fp):
+        return pitch_markov, onset_markov, tunes
+    with np.load(checkpoint_fp) as data:
+        for name, markov in [("pitch", pitch_markov), ("onset", onset_markov)]:
+            markov.transition_count = data[f"{name}_transition_count"]
+            markov.init_count = data[f"{name}_init_count"].tolist()
+            markov.num_Tunes = int(data[f"{name}_num_Tunes"])
+        files = json.loads(str(data["files"]))
+        # each npz member is read once; the tunes keep slices of the arrays
+        pitches, onsets, offsets = data["pitches"], data["onsets"], data["offsets"]
+        for k, entry in enumerate(files):
+            start, end = offsets[k], offsets[k + 1]
+            entry["pitches"] = pitches[start:end]
+            entry["onsets"] = onsets[start:end]
+            tunes[entry.pop("name")] = entry
+    return pitch_markov, onset_markov, tunes
+
+def write_checkpoint(checkpoint_fp: str, pitch_markov: Markov, onset_markov: Markov, tunes: dict):
+    import numpy as np
+    arrays = {}
+    for name, markov in [("pitch", pitch_markov), ("onset", onset_markov)]:
+        arrays[f"{name}_transition_count"] = markov.transition_count
+        arrays[f"{name}_init_count"] = np.array(markov.init_count, dtype=np.int64)
+        arrays[f"{name}_num_Tunes"] = np.array(markov.num_Tunes)
+    names = sorted(tunes)
+    # the sequences of each tune are kept so that their counts can be subtracted when it changes
+    arrays["pitches"], arrays["offsets"] = concat_sequences([tunes[f]["pitches"] for f in names])
+    arrays["onsets"], _ = concat_sequences([tunes[f]["onsets"] for f in names])
+    arrays["files"] = np.array(json.dumps(
+        [{"name": f, "stat": tunes[f]["stat"], "hash": tunes[f]["hash"]} for f in names]))
+    os.makedirs(os.path.dirname(checkpoint_fp), exist_ok=True)
+    with open(checkpoint_fp, "wb") as wf:
+        np.savez(wf, **arrays)
+
+def train_incremental(coll_dir: str, mood: str, mode: list, timesig: int, checkpoint_fp: str):
+    """ update the checkpointed counts with the tunes added, changed or deleted since the last run """
+    pitch_markov, onset_markov, tunes = load_checkpoint(checkpoint_fp)
+
+    added = []
+    removed = []
+    moved = False
+    current = list_coll_files(coll_dir, mood, mode, timesig)
+    for f in current:
+        fp = os.path.join(coll_dir, mood, f)
+        st = os.stat(fp)
+        stat = [st.st_size, st.st_mtime_ns]
+        old = tunes.get(f)
+        # only hash files whose size or mtime moved
+        if old and old["stat"] == stat:
+            continue
+        moved = True
+        digest = file_hash(fp)
+        if old and old["hash"] == digest:
+            old["stat"] = stat
+            continue
+        if old:
+            removed.append(old)
+        onsets, pitches = read_coll_file(fp)
+        tunes[f] = {"stat": stat, "hash": digest, "pitches": pitches, "onsets": onsets}
+        added.append(tunes[f])
+        print(f"{f}")
+    for f in set(tunes) - set(current):
+        print(f"removed {f}")
+        removed.append(tunes.pop(f))
+
+    for markov, delta in zip([pitch_markov, onset_markov], markovs_from(added)):
+        markov.add_counts(delta)
+    for markov, delta in zip([pitch_markov, onset_markov], markovs_from(removed)):
+        markov.add_counts(delta, sign=-1)
+    print(f"{len(added)} tunes added or changed, {len(removed)} removed or changed, {len(tunes)} in total")
+
+    # a run that found nothing new leaves the checkpoint as it is
+    if moved or removed or not os.path.exists(checkpoint_fp):
+        write_checkpoint(checkpoint_fp, pitch_markov, onset_markov, tunes)
+    return pitch_markov, onset_markov, tunes
+
+def augmentation(augment: bool, register: tuple = None) -> dict:
+    """ the model metadata of the key augmentation (None without it) """
+    if not augment:
+        return None
+    return {"shifts": key_shifts, "register": list(register or (0, num_pitches - 1))}
+
+def coll_entries(coll_dir: str):
+    """ yields (mood, coll file name, path, content hash) of every coll file of the mood directories """
+    for mood in sorted(os.listdir(coll_dir)):
+        if mood.startswith('.') or not os.path.isdir(os.path.join(coll_dir, mood)):
+            continue
+        for f in sorted(list_coll_files(coll_dir, mood, ["+", "-"], None)):
+            fp = os.path.join(coll_dir, mood, f)
+            yield mood, f, fp, file_hash(fp)
+
+def tune_store_entries(store_dir: str):
+    """ same as coll_entries, from the mood tags of a tune store """
+    from tune_store import TuneStore
+    store = TuneStore(store_dir)
+    for mood in sorted(store.index["mood"]):
+        for tune_hash in store.select(mood):
+            yield mood, store.tunes[tune_hash]["name"] + ".txt", store.coll_path(tune_hash), tune_hash
+
+def train_bank(coll_dir: str, bank_dir: str, order: int = 1, augment: bool = False, register: tuple = None,
+    tune_store: str = None, joint: bool = False):
+    """ train every (mood, mode, timesig) model in one pass over the coll files (or a tune store) """
+    # (mood, mode, timesig) => (pitch seqs, onset seqs, tune name => hash)
+    models = {}
+    # parsed sequences by content hash, so a tune shared by several moods is tokenized once
+    parsed = {}
+    entries = tune_store_entries(tune_store) if tune_store else coll_entries(coll_dir)
+    for mood, f, fp, digest in entries:
+        if digest not in parsed:
+            parsed[digest] = read_coll_file(fp)
+        onsets, pitches = parsed[digest]
+        fname = os.path.splitext(f)[0]
+        fmode = "major" if fname[-2] == "+" else "minor"
+        ftime = int(fname[-1])
+        # route the tune to its specific mode and to the model of both modes
+        for mode_name in [fmode, "both"]:
+            pitch_seqs, onset_seqs, sources = models.setdefault((mood, mode_name, ftime), ([], [], {}))
+            pitch_seqs.append(pitches)
+            onset_seqs.append(onsets)
+            sources[f] = digest
+
+    index = []
+    for (mood, mode_name, ftime), (pitch_seqs, onset_seqs, sources) in sorted(models.items()):
+        model_name = f"{mood}_{mode_name}_{ftime}"
+        model_dir = os.path.join(bank_dir, model_name)
+        os.makedirs(model_dir, exist_ok=True)
+        pitch_markov = Markov(num_pitches)
+        onset_markov = Markov(num_onsets)
+        pitch_batch = concat_sequences(pitch_seqs)
+        onset_batch = concat_sequences(onset_seqs)
+        if joint:
+            write_joint_markov(model_dir, joint_markov(pitch_batch, onset_batch, augment, register),
+                mood=mood, mode=mode_name, timesig=ftime, sources=sources, augment=augmentation(augment, register))
+        if augment:
+            pitch_batch = augment_keys(*pitch_batch, register)
+        pitch_markov.add_transitions_batch(*pitch_batch)
+        onset_markov.add_transitions_batch(*onset_batch)
+        write_markovs(model_dir, pitch_markov, onset_markov, mood=mood, mode=mode_name, timesig=ftime,
+            sources=sources, augment=augmentation(augment, register))
+        if order > 1:
+            from ngram_markov import NgramMarkov
+            for name, num_states, batch in [("pitch", num_pitches, pitch_batch), ("onset", num_onsets, onset_batch)]:
+                markov = NgramMarkov(num_states, order)
+                markov.add_transitions_batch(*batch)
+                markov.write_model(os.path.join(model_dir, f"{name}_markov_order{order}.npz"))
+        index.append({"name": model_name, "mood": mood, "mode": mode_name, "timesig": ftime,
+            "tunes": sorted(sources)})
+
+    with open(os.path.join(bank_dir, "index.json"), "w") as wf:
+        json.dump(index, wf, indent=1)
+    print(f"{len(index)} models from {len(parsed)} unique tunes written to {bank_dir}")
+
+def main(args):
+    coll_dir = args.colldir
+    out_dir = args.outdir
+
+    if args.all:
+        train_bank(coll_dir, args.bank, args.order, args.augment, args.register, args.tunestore, args.joint)
+        return
+
+    mood = args.mood
+    mode = get_modes(args.mode)
+    timesig = args.timesig
+    os.makedirs(out_dir, exist_ok=True)
+
+    # initialize pitch and onset markovs
+    pitch_markov = Markov(num_pitches)
+    onset_markov = Markov(num_onsets)
+    joint = None
+
+    if args.incremental:
+        checkpoint_fp = args.checkpoint or os.path.join(
+            parent_dir, "checkpoints", f"{mood}_{args.mode or 'both'}_{timesig}.npz")
+        pitch_markov, onset_markov, tunes = train_incremental(coll_dir, mood, mode, timesig, checkpoint_fp)
+        sources = {f: t["hash"] for f, t in tunes.items()}
+        # the first-order counts come from the checkpoint; only the joint and order-N models need the sequences
+        if args.joint or args.order > 1:
+            pitch_batch = concat_sequences([t["pitches"] for t in tunes.values()])
+            onset_batch = concat_sequences([t["onsets"] for t in tunes.values()])
+        if args.joint:
+            joint = joint_markov(pitch_batch, onset_batch)
+    else:
+        if args.store:
+            tunes = read_store_tunes(args.store, mood, mode, timesig)
+            # the tunes of a store are only traceable to the store itself
+            sources = {os.path.basename(args.store): file_hash(args.store)}
+        elif args.tunestore:
+            from tune_store import TuneStore
+            store = TuneStore(args.tunestore)
+            selected = store.select(mood, mode, timesig)
+            tunes = store.read_tunes(selected)
+            # the store is keyed by the hash of each coll
+            sources = {store.tunes[h]["name"] + ".txt": h for h in selected}
+        else:
+            tunes = read_coll_tunes(coll_dir, mood, mode, timesig)
+            sources = {}
+        pitch_seqs = []
+        onset_seqs = []
+        for name, onsets, pitches in tunes:
+            print(f"{name}")
+            pitch_seqs.append(pitches)
+            onset_seqs.append(onsets)
+            if not (args.store or args.tunestore):
+                sources[name] = file_hash(os.path.join(coll_dir, mood, name))
+        instrument.count("train.tunes", len(pitch_seqs))
+        instrument.count("train.notes", sum(len(seq) for seq in pitch_seqs))
+        pitch_batch = concat_sequences(pitch_seqs)
+        onset_batch = concat_sequences(onset_seqs)
+        if args.joint:
+            joint = joint_markov(pitch_batch, onset_batch, args.augment, args.register)
+        if args.augment:
+            # every tune in every key that fits, as an array add instead of re-parsing transposed scores
+            pitch_batch = augment_keys(*pitch_batch, args.register)
+        # add transitions for pitch and onset to the corresponding markov, all tunes at once
+        pitch_markov.add_transitions_batch(*pitch_batch)
+        onset_markov.add_transitions_batch(*onset_batch)
     # after adding transitions from each file of the wanted categories, output the transition table
-    pitch_markov.write_transitions("pitch_markov.txt")
-    onset_markov.write_transitions("onset_markov.txt")
+    write_markovs(out_dir, pitch_markov, onset_markov, mood=mood, mode=args.mode or "both", timesig=timesig,
+        sources=sources, augment=augmentation(args.augment, args.register))
+    if joint:
+        write_joint_markov(out_dir, joint, mood=mood, mode=args.mode or "both", timesig=timesig,
+            sources=sources, augment=augmentation(args.augment, args.register))
+
+    # the Max patch only reads first-order tables; higher orders are written as a context index
+    if args.order > 1:
+        from ngram_markov import NgramMarkov
+        for name, num_states, batch in [("pitch", num_pitches, pitch_batch), ("onset", num_onsets, onset_batch)]:
+            markov = NgramMarkov(num_states, args.order)
+            markov.add_transitions_batch(*batch)
+            markov.write_model(os.path.join(out_dir, f"{name}_markov_order{args.order}.npz"))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--mood",
-        type=str,
-        help="mood category"
-    )
-    parser.add_argument(
-        "--mode",
-        type=str,
-        help="major or minor mode"
-    )
-    parser.add_argument(
-        "--timesig",
-        type=int,
-        help="the time signature beat count"
-    )
+    cli.add_train_arguments(parser)
 
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    cli.check_train_arguments(parser, args)
+    main(args)
@@ -0,0 +1,127 @@
+import random
+
+# pitch classes of the scale every coll is normalized to (C minor / Eb major)
+pitch_class = [0, 2, 3, 5, 7, 8, 10, 12]
+
+# lookup tables indexed by pitch class (pitch % 12):
+# whether the tone is out of the scale, and the steps to the closest in-scale tone below / above
+out_of_scale = [tone not in pitch_class for tone in range(12)]
+step_below = [max(t for t in pitch_class if t <= tone) - tone for tone in range(12)]
+step_above = [min(t for t in pitch_class if t >= tone) - tone for tone in range(12)]
+
+# candidate end pitches around the requested one, for auditioning every sequence target
+target_sets = ["pitches", "degrees"]
+
+
+def get_closest_inscale_tones(tone: int):
+    if out_of_scale[tone]:
+        return [tone + step_below[tone], tone + step_above[tone]]
+
+
+def transpose_statement(pitches: list, durs: list, endpitch: int, last_pitch: int,
+    rng: random.Random = random) -> list:
+    """
+    new pitches of a statement sequenced to end on endpitch, for every note but the rests
+    (which are dropped); last_pitch is the pitch the sequence follows (the coll's last note)
+    """
+    interval = endpitch - pitches[-1]
+    new_pitches = []
+    for seq_i, (pitch, dur) in enumerate(zip(pitches, durs)):
+        # since the rest in a statement can only be at the beginning,
+        # we simply remove the rest, so that we would extend the last note during tidy-up
+        if dur < 0:
+            continue
+        if pitch <= 0:
+            new_pitches.append(pitch)
+            last_pitch = pitch
+            continue
+
+        # change pitch level: keep the interval from the previous note (the contour)
+        last_pitch_original = pitches[seq_i-1]
+        if seq_i == 0 or last_pitch_original <= 0:
+            new_pitch = pitch + interval
+        else:
+            new_pitch = pitch - last_pitch_original + last_pitch
+
+        # deal with out-of-scale tones => diatonic transposition
+        tone = new_pitch % 12
+        if out_of_scale[tone]:
+            # the alternatives keep the register int(new_pitch / 12), which rounds up below pitch 0
+            register_shift = 12 if new_pitch < 0 else 0
+            alt_pitches = [new_pitch + step_below[tone] + register_shift,
+                new_pitch + step_above[tone] + register_shift]
+            if seq_i == 0:
+                new_pitch = rng.choice(alt_pitches)
+                # first note in seq should not be the same as the original first note
+                if new_pitch == pitch:
+                    alt_pitches.remove(new_pitch)
+                    new_pitch = alt_pitches[0]
+            # not first note: pick the alt note with the original direction relative to the previous pitch
+            elif last_pitch < new_pitch:
+                new_pitch = alt_pitches[1]
+            else:
+                new_pitch = alt_pitches[0]
+        new_pitches.append(new_pitch)
+        last_pitch = new_pitch
+    return new_pitches
+
+
+def transpose_all(pitches: list, durs: list, endpitches: list, last_pitch: int, seed: int = None):
+    """
+    transpose_statement for many end pitches at once: (N, K) array of the new pitches of the
+    K non-rest notes, one row per end pitch. row k is what transpose_statement gives for
+    endpitches[k] with a fresh random.Random(seed), as sequence.py --seed uses.
+    """
+    import numpy as np
+
+    out_table = np.array(out_of_scale)
+    below_table = np.array(step_below)
+    above_table = np.array(step_above)
+
+    endpitches = np.asarray(endpitches, dtype=np.int64)
+    interval = endpitches - pitches[-1]
+    last = np.full(endpitches.size, last_pitch, dtype=np.int64)
+    columns = []
+    for seq_i, (pitch, dur) in enumerate(zip(pitches, durs)):
+        if dur < 0:
+            continue
+        if pitch <= 0:
+            last = np.full(endpitches.size, pitch, dtype=np.int64)
+            columns.append(last)
+            continue
+
+        last_pitch_original = pitches[seq_i-1]
+        if seq_i == 0 or last_pitch_original <= 0:
+            new = pitch + interval
+        else:
+            new = pitch - last_pitch_original + last
+
+        tone = new % 12
+        register_shift = np.where(new < 0, 12, 0)
+        below = new + below_table[tone] + register_shift
+        above = new + above_table[tone] + register_shift
+        if seq_i == 0:
+            # the only draw of transpose_statement, rng.choice([below, above]): with a seed it is the
+            # first draw of random.Random(seed) for every end pitch, without one a draw of the random module each
+            if seed is not None:
+                pick_above = np.full(endpitches.size, random.Random(seed).choice([False, True]))
+            else:
+                pick_above = np.array([random.choice([False, True]) for _ in range(endpitches.size)], dtype=bool)
+            alt = np.where(pick_above, above, below)
+            alt = np.where(alt == pitch, np.where(pick_above, below, above), alt)
+        else:
+            alt = np.where(last < new, above, below)
+        last = np.where(out_table[tone], alt, new)
+        columns.append(last)
+    if not columns:
+        return np.zeros((endpitches.size, 0), dtype=np.int64)
+    return np.stack(columns, axis=1)
+
+
+def candidate_endpitches(endpitch: int, targets: str) -> list:
+    """ every end pitch within an octave of endpitch, or the closest end pitch of every scale degree """
+    if targets == "pitches":
+        return list(range(endpitch - 12, endpitch + 13))
+    if targets == "degrees":
+        return [p for p in range(endpitch - 6, endpitch + 6) if not out_of_scale[p % 12]]
+    raise ValueError(f"unknown target set {targets}, expected one of {target_sets}")
@@ -0,0 +1,147 @@
+#!/usr/local/bin/python3.7
+
+import argparse
+import hashlib
+import json
+import os
+
+from corpus_store import read_coll_columns
+
+parent_dir = os.path.dirname(os.path.abspath(__file__))
+
+# store layout: tunes/<sha1 of the coll>.txt, each unique tune once, and index.json with
+# the tunes (name, mode, timesig, notes, moods), the midi files they were parsed from and the tag indexes
+index_name = "index.json"
+tags = ["mood", "mode", "timesig"]
+
+
+class TuneStore:
+    """ content-addressed coll files; moods, modes and timesigs are tag queries instead of directories """
+
+    def __init__(self, root: str):
+        self.root = root
+        # tune hash => {"name", "mode", "timesig", "notes", "moods"}
+        self.tunes = {}
+        # midi file hash => {"tune": tune hash (None if discarded), "settings": parser settings}
+        self.sources = {}
+        index_fp = os.path.join(root, index_name)
+        if os.path.exists(index_fp):
+            with open(index_fp) as rf:
+                index = json.load(rf)
+            self.tunes = index["tunes"]
+            self.sources = index["sources"]
+        self.index = self.build_index()
+
+    def coll_path(self, tune_hash: str) -> str:
+        return os.path.join(self.root, "tunes", tune_hash + ".txt")
+
+    def add_coll(self, coll_fp: str, name: str = None, moods: list = ()) -> str:
+        """ store a coll file under its content hash (once) and tag it with the moods; returns the hash """
+        with open(coll_fp, "rb") as rf:
+            data = rf.read()
+        tune_hash = hashlib.sha1(data).hexdigest()
+        if tune_hash not in self.tunes:
+            store_fp = self.coll_path(tune_hash)
+            os.makedirs(os.path.dirname(store_fp), exist_ok=True)
+            with open(store_fp + ".tmp", "wb") as wf:
+                wf.write(data)
+            os.replace(store_fp + ".tmp", store_fp)
+            name = name or os.path.splitext(os.path.basename(coll_fp))[0]
+            # mode and timesig from the file name, as for the coll directories (none if it does not follow it)
+            named = len(name) > 1 and name[-2] in "+-" and name[-1].isdigit()
+            self.tunes[tune_hash] = {
+                "name": name,
+                "mode": name[-2] if named else None,
+                "timesig": int(name[-1]) if named else None,
+                "notes": data.count(b";\n"),
+                "moods": [],
+            }
+        self.tag(tune_hash, moods)
+        return tune_hash
+
+    def tag(self, tune_hash: str, moods: list):
+        entry = self.tunes[tune_hash]
+        entry["moods"] = sorted(set(entry["moods"]) | set(moods))
+
+    def build_index(self) -> dict:
+        """ tag => value => sorted tune hashes """
+        index = {tag: {} for tag in tags}
+        for tune_hash, entry in sorted(self.tunes.items()):
+            for mood in entry["moods"]:
+                index["mood"].setdefault(mood, []).append(tune_hash)
+            if entry["mode"] is not None:
+                index["mode"].setdefault(entry["mode"], []).append(tune_hash)
+                index["timesig"].setdefault(str(entry["timesig"]), []).append(tune_hash)
+        return index
+
+    def select(self, mood: str = None, mode: list = ["+", "-"], timesig: int = None) -> list:
+        """ sorted hashes of the tunes tagged with the mood (any if None), one of the modes and the timesig """
+        selected = set(self.index["mood"].get(mood, []) if mood else self.tunes)
+        selected &= set(h for m in mode for h in self.index["mode"].get(m, []))
+        if timesig is not None:
+            selected &= set(self.index["timesig"].get(str(timesig), []))
+        return sorted(selected)
+
+    def read_tunes(self, tune_hashes: list):
+        """ yields (coll file name, onsets, pitches) of the tunes, as train.read_coll_tunes """
+        for tune_hash in tune_hashes:
+            onsets, pitches, _ = read_coll_columns(self.coll_path(tune_hash))
+            yield self.tunes[tune_hash]["name"] + ".txt", onsets, pitches
+
+    def prune(self) -> int:
+        """ drop the tunes without any mood and the midi sources of dropped tunes; returns how many """
+        dropped = [h for h, entry in self.tunes.items() if not entry["moods"]]
+        for tune_hash in dropped:
+            del self.tunes[tune_hash]
+            if os.path.exists(self.coll_path(tune_hash)):
+                os.remove(self.coll_path(tune_hash))
+        self.sources = {digest: source for digest, source in self.sources.items()
+            if source["tune"] is None or source["tune"] in self.tunes}
+        return len(dropped)
+
+    def save(self):
+        self.index = self.build_index()
+        os.makedirs(self.root, exist_ok=True)
+        index_fp = os.path.join(self.root, index_name)
+        with open(index_fp + ".tmp", "w") as wf:
+            json.dump({"tunes": self.tunes, "sources": self.sources, "tags": self.index}, wf, indent=1, sort_keys=True)
+        os.replace(index_fp + ".tmp", index_fp)
+
+
+def import_colls(coll_dir: str, store_dir: str):
+    """ add every coll of the mood directories, tagged with its mood """
+    store = TuneStore(store_dir)
+    num_files = 0
+    for mood in sorted(os.listdir(coll_dir)):
+        mood_dir = os.path.join(coll_dir, mood)
+        if mood.startswith('.') or not os.path.isdir(mood_dir):
+            continue
+        for f in sorted(os.listdir(mood_dir)):
+            if f.endswith('.txt') and not f.startswith('.'):
+                store.add_coll(os.path.join(mood_dir, f), moods=[mood])
+                num_files += 1
+    store.save()
+    print(f"{num_files} coll files stored as {len(store.tunes)} unique tunes in {store_dir}")
+
+
+def main(args):
+    import_colls(args.colldir, args.out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store the coll files of the mood directories once per unique tune")
+    parser.add_argument(
+        "--colldir",
+        type=str,
+        default=os.path.join(parent_dir, "midi_coll"),
+        help="root directory of the mood folders of coll files"
+    )
+    parser.add_argument(
+        "--out",
+        type=str,
+        default=os.path.join(parent_dir, "tune_store"),
+        help="directory of the tune store"
+    )
+
+    args = parser.parse_args()
+    main(args)
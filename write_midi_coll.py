@@ -1,22 +1,33 @@
 #!/usr/local/bin/python3.7
 
 import argparse
+import hashlib
 import json
 import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from music21 import *
+import cli
+import coll_codec
+import fast_midi_coll
+import instrument
+from constants import quarter_length_divisors, tick_quarter
 
-# tick of a quarter note
-tick_quarter = 12
+# music21 is imported inside the functions that use it, the fast backend never needs it
 
-def normalize_score(score: stream.Score, to_tonic: str = 'E-'):
+# ingestion manifest, kept at the root of the coll directory
+manifest_name = ".ingest_manifest.json"
+
+def normalize_score(score: "stream.Score", to_tonic: str = 'E-'):
     """ normalize key to 3flats (Cm or EbM)"""
+    from music21 import interval, key, note
     keys = score.getElementsByClass(key.KeySignature)
     starting_tonic = keys[0].tonic.name
     i = interval.Interval(note.Note(starting_tonic), note.Note(to_tonic))
     score.transpose(i, inPlace=True)
 
-def get_onset_tick(note: note.Note) -> int:
+def get_onset_tick(note: "note.Note") -> int:
     # 1 => first beat => onset = 0 (smallest value)
     # 1 1/2 => dotted after first beat => onset = 6
     # 2 1/3 => triplet after second beat => onset = 16
@@ -39,11 +50,13 @@ def parse_file(midi_file: str, coll_dir: str = "midi_coll", normalize_key: bool
     name = os.path.splitext(os.path.basename(midi_file))[0]
     coll_fp = os.path.join(coll_dir, mood_dir_name, name) + ".txt"
 
-        
-    score = converter.parse(midi_file, format='midi', quarterLengthDivisors=[12,16])
-    score = score.flatten()
+    from music21 import converter, meter
+    with instrument.timer("parse.read", file=midi_file):
+        score = converter.parse(midi_file, format='midi', quarterLengthDivisors=quarter_length_divisors)
+        score = score.flatten()
     if normalize_key:
-        normalize_score(score)
+        with instrument.timer("parse.normalize", file=midi_file):
+            normalize_score(score)
 
     for t in score.getElementsByClass(meter.TimeSignature):
         num_beats = t.numerator
@@ -51,11 +64,12 @@ def parse_file(midi_file: str, coll_dir: str = "midi_coll", normalize_key: bool
         print(f'Time signature: {num_beats}/{beat_length}')
         if beat_length != 4:
             print(f'This program only supports beat length of 4 for now. Discarded.')
-            return
+            instrument.count("parse.skipped_beat_length")
+            return None
 
-    with open(coll_fp, "w") as wf:
+    with instrument.timer("parse.write", file=midi_file):
         notes = score.notes
-        note_i = -1
+        onsets, pitches, durs, vels = [], [], [], []
         for i, note in enumerate(notes):
             # onset in the current measure
             onset = get_onset_tick(note)
@@ -68,10 +82,178 @@ def parse_file(midi_file: str, coll_dir: str = "midi_coll", normalize_key: bool
             dur = 100
             # vel
             vel = note.volume.velocity
-            # coll index
-            note_i += 1
-            # write to file in Max coll format
-            wf.write(f"{note_i}, {onset} {midi_num} {dur} {vel};\n")
+            onsets.append(onset)
+            pitches.append(midi_num)
+            durs.append(dur)
+            vels.append(vel)
+        # write to file in Max coll format, indexed from 0
+        coll_codec.write(coll_fp, range(len(pitches)), onsets, pitches, durs, vels)
+    instrument.count("parse.notes", len(pitches))
+    return coll_fp
+
+def file_hash(fp: str) -> str:
+    with open(fp, "rb") as rf:
+        return hashlib.sha1(rf.read()).hexdigest()
+
+def parser_settings(normalize_key: bool = True, backend: str = "music21") -> dict:
+    # everything that changes the parsed output; a change invalidates the manifest entries
+    return {
+        "quarterLengthDivisors": quarter_length_divisors,
+        "normalize_key": normalize_key,
+        "backend": backend,
+    }
+
+def get_parser(backend: str):
+    # music21 is the reference parser; fast reads the midi tick stream directly
+    if backend == "fast":
+        return fast_midi_coll.parse_file
+    return parse_file
+
+def load_manifest(coll_dir: str) -> dict:
+    manifest_fp = os.path.join(coll_dir, manifest_name)
+    if not os.path.exists(manifest_fp):
+        return {}
+    with open(manifest_fp) as rf:
+        return json.load(rf)
+
+def write_manifest(coll_dir: str, manifest: dict):
+    manifest_fp = os.path.join(coll_dir, manifest_name)
+    with open(manifest_fp, "w") as wf:
+        json.dump(manifest, wf, indent=1, sort_keys=True)
+
+def is_up_to_date(entry: dict, digest: str, settings: dict) -> bool:
+    if not entry or entry["hash"] != digest or entry["settings"] != settings:
+        return False
+    # discarded files have no coll to check
+    return entry["coll"] is None or os.path.exists(entry["coll"])
+
+def parse_folder(midi_folder: str, coll_dir: str = "midi_coll", workers: int = 1,
+    normalize_key: bool = True, force: bool = False, backend: str = "music21"):
+    settings = parser_settings(normalize_key, backend)
+    parse = get_parser(backend)
+    manifest = {} if force else load_manifest(coll_dir)
+
+    # collect the midi files that are new or changed since the last ingestion;
+    # they are keyed by their path within the midi folder, however the folder is spelled
+    jobs = []
+    skipped = 0
+    current = set()
+    for dir_name in os.listdir(midi_folder):
+        if dir_name.startswith('.'):
+            continue
+        coll_dir_path = os.path.join(coll_dir, dir_name)
+        if not os.path.exists(coll_dir_path):
+            os.makedirs(coll_dir_path)
+        for file_name in os.listdir(os.path.join(midi_folder, dir_name)):
+            if file_name.startswith('.'):
+                continue
+            fp = os.path.join(midi_folder, dir_name, file_name)
+            key = os.path.join(dir_name, file_name)
+            current.add(key)
+            digest = file_hash(fp)
+            if is_up_to_date(manifest.get(key), digest, settings):
+                skipped += 1
+                continue
+            jobs.append((fp, key, digest))
+    # midi files that were deleted (or entries of an older manifest layout) are dropped
+    manifest = {key: entry for key, entry in manifest.items() if key in current}
+    print(f"{len(jobs)} midi files to parse, {skipped} unchanged")
+
+    failed = []
+    def record(fp: str, key: str, digest: str, parsed):
+        try:
+            coll_fp = parsed()
+        except Exception as e:
+            # left out of the manifest, so the file is parsed again next time
+            print(f"failed {fp}: {type(e).__name__}: {e}")
+            failed.append(fp)
+            return
+        print(fp)
+        manifest[key] = {"hash": digest, "settings": settings, "coll": coll_fp}
+
+    # the manifest keeps every file parsed so far, even if the run is interrupted
+    try:
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(parse, fp, coll_dir, normalize_key): (fp, key, digest)
+                    for fp, key, digest in jobs}
+                for future in as_completed(futures):
+                    record(*futures[future], future.result)
+        else:
+            for fp, key, digest in jobs:
+                record(fp, key, digest, lambda: parse(fp, coll_dir=coll_dir, normalize_key=normalize_key))
+    finally:
+        write_manifest(coll_dir, manifest)
+    if failed:
+        print(f"{len(failed)} midi files failed to parse")
+
+def ingest_store(midi_folder: str, store_dir: str, workers: int = 1,
+    normalize_key: bool = True, force: bool = False, backend: str = "music21"):
+    """ parse each unique midi file of the mood folders once into the tune store, tagged with all its moods """
+    from tune_store import TuneStore
+    settings = parser_settings(normalize_key, backend)
+    parse = get_parser(backend)
+    store = TuneStore(store_dir)
+
+    # midi hash => (first file with that content, moods it is filed under)
+    unique = {}
+    num_files = 0
+    for dir_name in sorted(os.listdir(midi_folder)):
+        if dir_name.startswith('.'):
+            continue
+        for file_name in sorted(os.listdir(os.path.join(midi_folder, dir_name))):
+            if file_name.startswith('.'):
+                continue
+            fp = os.path.join(midi_folder, dir_name, file_name)
+            unique.setdefault(file_hash(fp), (fp, set()))[1].add(dir_name)
+            num_files += 1
+    jobs = [(digest, fp) for digest, (fp, _) in unique.items()
+        if force or store.sources.get(digest, {}).get("settings") != settings]
+    print(f"{num_files} midi files, {len(unique)} unique, {len(jobs)} to parse")
+
+    # the parsers write <coll dir>/<mood>/<name>.txt; stage those before moving them into the store
+    staging = tempfile.mkdtemp(dir=store_dir if os.path.isdir(store_dir) else None)
+    failed = []
+    def record(digest: str, fp: str, parsed):
+        try:
+            coll_fp = parsed()
+        except Exception as e:
+            # left out of the sources, so the file is parsed again next time
+            print(f"failed {fp}: {type(e).__name__}: {e}")
+            failed.append(fp)
+            return
+        print(fp)
+        tune_hash = store.add_coll(coll_fp) if coll_fp else None
+        store.sources[digest] = {"tune": tune_hash, "settings": settings}
+
+    # the index keeps every tune added so far, even if the run is interrupted
+    try:
+        try:
+            for _, fp in jobs:
+                os.makedirs(os.path.join(staging, os.path.basename(os.path.dirname(fp))), exist_ok=True)
+            if workers > 1 and len(jobs) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [(digest, fp, pool.submit(parse, fp, staging, normalize_key)) for digest, fp in jobs]
+                    for digest, fp, future in futures:
+                        record(digest, fp, future.result)
+            else:
+                for digest, fp in jobs:
+                    record(digest, fp, lambda: parse(fp, coll_dir=staging, normalize_key=normalize_key))
+        finally:
+            shutil.rmtree(staging)
+    finally:
+        # the moods are re-tagged from the folders as they are now
+        for entry in store.tunes.values():
+            entry["moods"] = []
+        for digest, (_, moods) in unique.items():
+            tune_hash = store.sources.get(digest, {}).get("tune")
+            if tune_hash:
+                store.tag(tune_hash, moods)
+        dropped = store.prune()
+        store.save()
+    if failed:
+        print(f"{len(failed)} midi files failed to parse")
+    print(f"{len(store.tunes)} tunes in {store_dir}, {dropped} no longer in any mood folder")
 
 def main(args):
     midi_file = args.midifile
@@ -80,34 +262,17 @@ def main(args):
     coll_dir = "midi_coll"
 
     if midi_file:
-        parse_file(midi_file)
+        get_parser(args.backend)(midi_file)
     
-    if midi_folder:
-        for dir_name in os.listdir(midi_folder):
-            if dir_name.startswith('.'):
-                continue
-            coll_dir_path = os.path.join(coll_dir, dir_name)
-            if not os.path.exists(coll_dir_path):
-                os.mkdir(coll_dir_path)
-            for file_name in os.listdir(os.path.join(midi_folder, dir_name)):
-                if file_name.startswith('.'):
-                    continue
-                fp = os.path.join(midi_folder, dir_name, file_name)
-                print(fp)
-                parse_file(fp, coll_dir=coll_dir)
+    if midi_folder and args.tunestore:
+        ingest_store(midi_folder, args.tunestore, workers=args.workers, force=args.force, backend=args.backend)
+    elif midi_folder:
+        parse_folder(midi_folder, coll_dir=coll_dir, workers=args.workers, force=args.force,
+            backend=args.backend)
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parse a midi file into Tone.js-friendly JSON format at: https://tonejs.github.io/Midi/")
-    parser.add_argument(
-        "--midifile",
-        type=str,
-        help="path to a midi file. "
-    )
-    parser.add_argument(
-        "--midifolder",
-        type=str,
-        help="path to a folder that contains midi files."
-    )
+    cli.add_ingest_arguments(parser)
 
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)